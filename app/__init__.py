@@ -1,38 +1,75 @@
-from flask import Flask
+import logging
+from flask import Flask, json
 from flask_socketio import SocketIO
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from flask_login import LoginManager
 from flask_cors import CORS
+from .routing import RoutingSession
 
 # Initialize extensions
-socketio = SocketIO(cors_allowed_origins="*")
-db = SQLAlchemy()
+socketio = SocketIO(cors_allowed_origins="*", json=json)  # Flask JSON so emitted datetimes serialize like jsonify
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 migrate = Migrate()
 login_manager = LoginManager()
 
-def create_app():
+def create_app(config=None):
     app = Flask(__name__)
     app.config.from_object('config.Config')
+    if config:
+        app.config.update(config)
+
+    logging.basicConfig(level=app.config.get('LOG_LEVEL', 'INFO'))
+
+    from . import serialization, responses, metrics
+    serialization.init_app(app)
+    responses.init_app(app)
+    metrics.init_app(app)
+
+    # Import routes before socketio.init_app so its event handlers are queued on the
+    # extension and re-registered on the server built for every app instance
+    from .routes import main as main_blueprint
 
     # Initialize extensions with the app
     db.init_app(app)
     migrate.init_app(app, db)
-    socketio.init_app(app)
+    socketio.init_app(app,
+                      message_queue=app.config.get('SOCKETIO_MESSAGE_QUEUE'),
+                      channel=app.config.get('SOCKETIO_CHANNEL', 'flask-socketio'))
     login_manager.init_app(app)
 
+    from .cache import user_cache
+    user_cache.init_app(app)
+    from .hashing import password_hasher
+    password_hasher.init_app(app)
+    from .search import search_index
+    search_index.init_app(app)
+    from .archive import message_archive
+    message_archive.init_app(app)
+
+    # In-process background services
+    from .presence import presence
+    presence.init_app(app, socketio)
+    from .writer import message_writer
+    message_writer.init_app(app)
+    from .likes import like_aggregator
+    like_aggregator.init_app(app)
+
     # Configure CORS to allow specific origins and support credentials
     CORS(app, supports_credentials=True, resources={r"/*": {"origins": "http://localhost:3000"}})
 
     login_manager.login_view = 'main.login'
 
     # Register blueprints
-    from .routes import main as main_blueprint
     app.register_blueprint(main_blueprint)
 
+    # Register CLI commands
+    from . import commands
+    commands.init_app(app)
+
     return app
 
 @login_manager.user_loader
 def load_user(user_id):
-    from .models.user import User
-    return User.query.get(int(user_id))
+    from .cache import user_cache
+    return user_cache.load(int(user_id))
@@ -0,0 +1,325 @@
+import gzip
+import json
+import logging
+import os
+from collections import Counter, deque, namedtuple
+from datetime import datetime
+
+from sqlalchemy import Column, DateTime, Index, Integer, MetaData, PrimaryKeyConstraint, String, Table, delete, func, insert, or_, select, text, tuple_, update
+from . import db
+from .export import EXPORT_COLUMNS
+from .models.conversation import Conversation
+from .models.message import Message
+from .models.message_like import MessageLike
+from .models.message_period import MessagePeriod
+from .models.message_period_conversation import MessagePeriodConversation
+from .search import search_index
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_COLUMNS = ('id', 'content', 'sender_id', 'recipient_id', 'conversation_key', 'client_msg_id', 'timestamp', 'likes')
+HISTORY_FIELDS = ('id', 'content', 'sender_id', 'timestamp')
+PARENT_TABLE = 'message_archive'
+
+# Shaped like the (id, timestamp) rows of the hot history query so both can be merged
+PagePosition = namedtuple('PagePosition', 'id timestamp')
+
+
+def month_start(moment, offset=0):
+    month = moment.year * 12 + moment.month - 1 + offset
+    return datetime(month // 12, month % 12 + 1, 1)
+
+
+def _archive_table(name, partitioned=False):
+    # Same columns as message, without foreign keys; PostgreSQL needs the partition key in the primary key
+    return Table(
+        name, MetaData(),
+        Column('id', Integer, nullable=False),
+        Column('content', String(500), nullable=False),
+        Column('sender_id', Integer),
+        Column('recipient_id', Integer),
+        Column('conversation_key', String(41), nullable=False),
+        Column('client_msg_id', String(64)),
+        Column('timestamp', DateTime, nullable=False),
+        Column('likes', Integer, nullable=False, default=0),
+        PrimaryKeyConstraint('id', 'timestamp') if partitioned else PrimaryKeyConstraint('id'),
+        Index(f'ix_{name}_conversation_timestamp_id', 'conversation_key', 'timestamp', 'id'),
+        **({'postgresql_partition_by': 'RANGE (timestamp)'} if partitioned else {}),
+    )
+
+
+class MessageArchive:
+    # Time tiers for message history: the message table holds the last MESSAGE_HOT_MONTHS,
+    # older months move to per-month tables, are later frozen to gzip NDJSON files and
+    # finally dropped once past MESSAGE_RETENTION_MONTHS. MessagePeriod is the catalog.
+
+    def __init__(self):
+        self.hot_months = 3
+        self.warm_months = 12
+        self.retention_months = None
+        self.directory = 'archive'
+        self.batch_size = 5000
+        self._tables = {}
+
+    def init_app(self, app):
+        self.hot_months = app.config.get('MESSAGE_HOT_MONTHS', self.hot_months)
+        self.warm_months = app.config.get('MESSAGE_WARM_MONTHS', self.warm_months)
+        self.retention_months = app.config.get('MESSAGE_RETENTION_MONTHS', self.retention_months)
+        # A relative directory is taken from the instance folder, not whatever the cwd happens to be
+        self.directory = os.path.join(app.instance_path, app.config.get('MESSAGE_ARCHIVE_DIR', self.directory))
+        self.batch_size = app.config.get('MESSAGE_ARCHIVE_BATCH_SIZE', self.batch_size)
+        if self.warm_months < self.hot_months:
+            raise ValueError('MESSAGE_WARM_MONTHS must not be less than MESSAGE_HOT_MONTHS')
+        if self.retention_months is not None and self.retention_months < self.warm_months:
+            raise ValueError('MESSAGE_RETENTION_MONTHS must not be less than MESSAGE_WARM_MONTHS')
+
+    def _table(self, name):
+        if name not in self._tables:
+            self._tables[name] = _archive_table(name)
+        return self._tables[name]
+
+    def extent(self, conversation_key):
+        # Scalar subqueries (first archived month start, last archived month end) for the
+        # conversation, meant to ride along in the caller's version-stamp query
+        periods = (
+            select(MessagePeriod.starts_at, MessagePeriod.ends_at)
+            .join(MessagePeriodConversation, MessagePeriodConversation.period_id == MessagePeriod.id)
+            .where(MessagePeriodConversation.conversation_key == conversation_key)
+            .subquery()
+        )
+        return select(func.min(periods.c.starts_at)).scalar_subquery(), select(func.max(periods.c.ends_at)).scalar_subquery()
+
+    def archived_until(self):
+        # End of the newest archived month; messages older than this have left the search index
+        return db.session.query(func.max(MessagePeriod.ends_at)).scalar()
+
+    def periods(self, conversation_key=None, since=None, until=None, newest_first=False):
+        query = db.session.query(MessagePeriod)
+        if conversation_key is not None:
+            query = query.join(MessagePeriodConversation, MessagePeriodConversation.period_id == MessagePeriod.id).filter(
+                MessagePeriodConversation.conversation_key == conversation_key)
+        if since is not None:
+            query = query.filter(MessagePeriod.ends_at > since)
+        if until is not None:
+            query = query.filter(MessagePeriod.starts_at <= until)
+        order = MessagePeriod.starts_at.desc() if newest_first else MessagePeriod.starts_at.asc()
+        return query.order_by(order).all()
+
+    # Reads
+
+    def extend_page(self, page, conversation_key, before, after, limit, archived_until):
+        # page holds up to limit + 1 hot (id, timestamp) rows in query order; archived_until is
+        # the end of the conversation's newest archived month (None when nothing is archived).
+        # Pages that stay newer than it never touch the archive; otherwise the conversation's
+        # months are merged in one at a time until none of the rest can place a row in the page.
+        newest_first = after is None
+        if archived_until is None:
+            return page, {}
+        if newest_first and len(page) > limit and page[-1].timestamp >= archived_until:
+            return page, {}
+        if not newest_first and after[0] >= archived_until:
+            return page, {}
+
+        merged = list(page)
+        records = {}
+        for period in self.periods(conversation_key, since=after[0] if after else None, until=before[0] if before else None,
+                                   newest_first=newest_first):
+            if len(merged) > limit:
+                edge = merged[limit].timestamp
+                if (edge >= period.ends_at) if newest_first else (edge < period.starts_at):
+                    break
+            for record in self._period_page(period, conversation_key, before, after, limit):
+                records[record['id']] = record
+                merged.append(PagePosition(record['id'], record['timestamp']))
+            merged.sort(key=lambda row: (row.timestamp, row.id), reverse=newest_first)
+            del merged[limit + 1:]
+        kept = {row.id for row in merged}
+        return merged, {message_id: record for message_id, record in records.items() if message_id in kept}
+
+    def _period_page(self, period, conversation_key, before, after, limit):
+        if period.tier == 'cold':
+            return self._cold_page(period, conversation_key, before, after, limit)
+        table = self._table(period.table_name)
+        position = tuple_(table.c.timestamp, table.c.id)
+        query = select(*(table.c[name] for name in HISTORY_FIELDS)).where(table.c.conversation_key == conversation_key)
+        if after:
+            query = query.where(position > tuple_(*after)).order_by(table.c.timestamp.asc(), table.c.id.asc())
+        else:
+            if before:
+                query = query.where(position < tuple_(*before))
+            query = query.order_by(table.c.timestamp.desc(), table.c.id.desc())
+        return [row._asdict() for row in db.session.execute(query.limit(limit + 1))]
+
+    def _cold_page(self, period, conversation_key, before, after, limit):
+        # Cold files are a sequential scan in (timestamp, id) order; they are meant to be read rarely
+        matches = deque(maxlen=limit + 1)
+        for record in self._read_cold(period):
+            if record['conversation_key'] != conversation_key:
+                continue
+            position = (record['timestamp'], record['id'])
+            if after:
+                if position > tuple(after):
+                    matches.append(record)
+                    if len(matches) > limit:
+                        break
+            elif before and position >= tuple(before):
+                break
+            else:
+                matches.append(record)
+        records = [{name: record[name] for name in HISTORY_FIELDS} for record in matches]
+        return records if after else records[::-1]
+
+    def _read_cold(self, period):
+        with gzip.open(period.path, 'rt', encoding='utf-8') as f:
+            for line in f:
+                record = json.loads(line)
+                record['timestamp'] = datetime.fromisoformat(record['timestamp'])
+                yield record
+
+    def export_rows(self, user_id, conversation_key=None, since=None, until=None):
+        # EXPORT_COLUMNS tuples from the archived months, oldest first; callers append the hot table
+        for period in self.periods(conversation_key, since=since, until=until):
+            if period.tier == 'cold':
+                for record in self._read_cold(period):
+                    if conversation_key is not None:
+                        if record['conversation_key'] != conversation_key:
+                            continue
+                    elif user_id not in (record['sender_id'], record['recipient_id']):
+                        continue
+                    if (since and record['timestamp'] < since) or (until and record['timestamp'] >= until):
+                        continue
+                    yield tuple(record[name] for name in EXPORT_COLUMNS)
+                continue
+            table = self._table(period.table_name)
+            query = select(*(table.c[name] for name in EXPORT_COLUMNS))
+            if conversation_key is not None:
+                query = query.where(table.c.conversation_key == conversation_key)
+            else:
+                query = query.where(or_(table.c.sender_id == user_id, table.c.recipient_id == user_id))
+            if since:
+                query = query.where(table.c.timestamp >= since)
+            if until:
+                query = query.where(table.c.timestamp < until)
+            query = query.order_by(table.c.timestamp.asc(), table.c.id.asc())
+            for row in db.session.execute(query.execution_options(yield_per=self.batch_size)):
+                yield tuple(row)
+
+    # Maintenance (`flask archive-messages`)
+
+    def rotate(self, now=None):
+        now = now or datetime.utcnow()
+        archived = self.archive_hot(month_start(now, -self.hot_months))
+        frozen = self.freeze(month_start(now, -self.warm_months))
+        expired = self.expire(month_start(now, -self.retention_months)) if self.retention_months is not None else 0
+        return archived, frozen, expired
+
+    def archive_hot(self, boundary):
+        oldest = db.session.query(func.min(Message.timestamp)).filter(Message.timestamp < boundary).scalar()
+        moved = 0
+        start = month_start(oldest) if oldest else boundary
+        while start < boundary:
+            end = month_start(start, 1)
+            moved += self._archive_month(start, end)
+            start = end
+        return moved
+
+    def _archive_month(self, start, end):
+        columns = [getattr(Message, name) for name in ARCHIVE_COLUMNS]
+        period = None
+        moved = 0
+        while True:
+            rows = db.session.execute(
+                select(*columns).where(Message.timestamp >= start, Message.timestamp < end).order_by(Message.id).limit(self.batch_size)
+            ).all()
+            if not rows:
+                break
+            if period is None:
+                period = self._warm_period(start, end)
+                if period is None:
+                    logger.warning('Period %s is already frozen; leaving %s-dated messages in the message table', f'{start:%Y-%m}', f'{start:%Y-%m}')
+                    break
+            ids = [row.id for row in rows]
+            db.session.execute(insert(self._table(period.table_name)), [row._asdict() for row in rows])
+            # message_like rows reference message.id; the archived copy keeps only the count
+            db.session.execute(delete(MessageLike).where(MessageLike.message_id.in_(ids)))
+            search_index.remove(rows)
+            db.session.execute(delete(Message).where(Message.id.in_(ids)))
+            self._record_conversations(period, Counter(row.conversation_key for row in rows))
+            period.row_count += len(rows)
+            period.first_id = min(ids) if period.first_id is None else min(period.first_id, min(ids))
+            period.last_id = max(ids) if period.last_id is None else max(period.last_id, max(ids))
+            db.session.commit()
+            moved += len(rows)
+        return moved
+
+    def _record_conversations(self, period, counts):
+        existing = db.session.query(MessagePeriodConversation).filter(
+            MessagePeriodConversation.period_id == period.id, MessagePeriodConversation.conversation_key.in_(counts))
+        for entry in existing:
+            entry.row_count += counts.pop(entry.conversation_key)
+        db.session.add_all(MessagePeriodConversation(period_id=period.id, conversation_key=key, row_count=count)
+                           for key, count in counts.items())
+
+    def _warm_period(self, start, end):
+        label = f'{start:%Y-%m}'
+        period = db.session.query(MessagePeriod).filter_by(period=label).first()
+        if period is None:
+            period = MessagePeriod(period=label, tier='warm', table_name=f'{PARENT_TABLE}_{start:%Y%m}',
+                                   starts_at=start, ends_at=end, row_count=0)
+            db.session.add(period)
+            db.session.flush()
+        elif period.tier != 'warm':
+            return None
+        if db.engine.dialect.name == 'postgresql':
+            _archive_table(PARENT_TABLE, partitioned=True).create(db.session.connection(), checkfirst=True)
+            db.session.execute(text(
+                f"CREATE TABLE IF NOT EXISTS {period.table_name} PARTITION OF {PARENT_TABLE} "
+                f"FOR VALUES FROM ('{start:%Y-%m-%d}') TO ('{end:%Y-%m-%d}')"
+            ))
+        else:
+            self._table(period.table_name).create(db.session.connection(), checkfirst=True)
+        return period
+
+    def freeze(self, boundary):
+        periods = db.session.query(MessagePeriod).filter(
+            MessagePeriod.tier == 'warm', MessagePeriod.ends_at <= boundary).order_by(MessagePeriod.starts_at).all()
+        os.makedirs(self.directory, exist_ok=True)
+        for period in periods:
+            table = self._table(period.table_name)
+            path = os.path.abspath(os.path.join(self.directory, f'messages-{period.period}.ndjson.gz'))
+            rows = db.session.execute(select(table).order_by(table.c.timestamp, table.c.id).execution_options(yield_per=self.batch_size))
+            count = 0
+            # Written under a temporary name so a crash never leaves a truncated file in the catalog
+            with gzip.open(path + '.tmp', 'wt', encoding='utf-8') as f:
+                for row in rows:
+                    record = row._asdict()
+                    record['timestamp'] = record['timestamp'].isoformat()
+                    f.write(json.dumps(record, ensure_ascii=False) + '\n')
+                    count += 1
+            os.replace(path + '.tmp', path)
+            db.session.execute(text(f'DROP TABLE {period.table_name}'))
+            self._tables.pop(period.table_name, None)
+            period.tier, period.path, period.table_name, period.row_count = 'cold', path, None, count
+            db.session.commit()
+        return len(periods)
+
+    def expire(self, boundary):
+        periods = db.session.query(MessagePeriod).filter(MessagePeriod.ends_at <= boundary).all()
+        for period in periods:
+            if period.tier == 'warm':
+                db.session.execute(text(f'DROP TABLE IF EXISTS {period.table_name}'))
+                self._tables.pop(period.table_name, None)
+            path = period.path
+            db.session.execute(delete(MessagePeriodConversation).where(MessagePeriodConversation.period_id == period.id))
+            db.session.delete(period)
+            db.session.commit()
+            if path and os.path.exists(path):
+                os.remove(path)
+        if periods:
+            # Inbox rows must not keep showing text from deleted messages
+            db.session.execute(update(Conversation).where(Conversation.last_message_at < boundary).values(last_message_snippet=None))
+            db.session.commit()
+        return len(periods)
+
+
+message_archive = MessageArchive()
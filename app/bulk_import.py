@@ -0,0 +1,179 @@
+import csv
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from sqlalchemy import insert, tuple_
+from werkzeug.security import generate_password_hash
+from . import db
+from .models.user import User
+from .models.message import Message, make_conversation_key
+
+
+def read_records(path):
+    # CSV with a header row, or NDJSON (.ndjson / .jsonl), one record per line
+    with open(path, newline='', encoding='utf-8') as f:
+        if path.endswith('.csv'):
+            yield from csv.DictReader(f)
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+
+
+def _hash_password(args):
+    password, method = args
+    return generate_password_hash(password, method)
+
+
+class Checkpoint:
+    # Number of source records already committed, so an interrupted import can resume
+
+    def __init__(self, path, restart=False):
+        self.path = path
+        self.done = 0
+        if restart and os.path.exists(path):
+            os.remove(path)
+        if os.path.exists(path):
+            with open(path) as f:
+                self.done = json.load(f)['records']
+
+    def save(self, records):
+        self.done = records
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'records': records}, f)
+        os.replace(tmp, self.path)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class Progress:
+    def __init__(self, echo, label, start):
+        self.echo = echo
+        self.label = label
+        self.records = start
+        self.inserted = 0
+        self.skipped = 0
+        self.started = time.monotonic()
+
+    def report(self):
+        elapsed = max(time.monotonic() - self.started, 1e-9)
+        self.echo(f'{self.label}: {self.records} read, {self.inserted} inserted, {self.skipped} skipped '
+                  f'({self.inserted / elapsed:.0f}/s)')
+
+
+def _batches(records, start, batch_size):
+    records = itertools.islice(records, start, None)
+    while True:
+        batch = list(itertools.islice(records, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def import_users(path, batch_size, workers, hash_method, checkpoint, echo):
+    progress = Progress(echo, 'users', checkpoint.done)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for batch in _batches(read_records(path), checkpoint.done, batch_size):
+            progress.records += len(batch)
+            # Set-based uniqueness: one IN query per column per batch, plus in-batch duplicates
+            usernames = {record.get('username') for record in batch}
+            emails = {record.get('email') for record in batch if record.get('email')}
+            taken_names = {name for name, in db.session.query(User.username).filter(User.username.in_(usernames))}
+            taken_emails = {email for email, in db.session.query(User.email).filter(User.email.in_(emails))} if emails else set()
+            rows = []
+            for record in batch:
+                username, email = record.get('username'), record.get('email') or None
+                if not username or username in taken_names or (email and email in taken_emails):
+                    progress.skipped += 1
+                    continue
+                if not record.get('password') and not record.get('password_hash'):
+                    progress.skipped += 1
+                    continue
+                taken_names.add(username)
+                if email:
+                    taken_emails.add(email)
+                rows.append({'username': username, 'email': email,
+                             'password': record.get('password'), 'password_hash': record.get('password_hash')})
+
+            to_hash = [row for row in rows if not row['password_hash']]
+            hashes = pool.map(_hash_password, [(row['password'], hash_method) for row in to_hash],
+                              chunksize=max(1, len(to_hash) // (workers * 4)))
+            for row, pwhash in zip(to_hash, hashes):
+                row['password_hash'] = pwhash
+            for row in rows:
+                del row['password']
+
+            if rows:
+                db.session.execute(insert(User), rows)
+            db.session.commit()
+            progress.inserted += len(rows)
+            checkpoint.save(progress.records)
+            progress.report()
+    return progress
+
+
+def _parse_timestamp(value):
+    if not value:
+        return datetime.utcnow()
+    return datetime.fromisoformat(value)
+
+
+def import_messages(path, batch_size, checkpoint, echo):
+    progress = Progress(echo, 'messages', checkpoint.done)
+    user_ids = {}
+    for batch in _batches(read_records(path), checkpoint.done, batch_size):
+        progress.records += len(batch)
+        # Usernames are resolved with one IN query per batch for names not seen yet
+        names = {record.get(field) for record in batch for field in ('sender', 'recipient') if record.get(field)}
+        missing = [name for name in names if name not in user_ids]
+        if missing:
+            if len(user_ids) > 1000000:
+                user_ids.clear()
+            user_ids.update(db.session.query(User.username, User.id).filter(User.username.in_(missing)))
+
+        rows = []
+        for record in batch:
+            sender_id = record.get('sender_id') or user_ids.get(record.get('sender'))
+            recipient_id = record.get('recipient_id') or user_ids.get(record.get('recipient'))
+            content = record.get('content')
+            if not sender_id or not recipient_id or not content:
+                progress.skipped += 1
+                continue
+            sender_id, recipient_id = int(sender_id), int(recipient_id)
+            rows.append({
+                'sender_id': sender_id,
+                'recipient_id': recipient_id,
+                'conversation_key': make_conversation_key(sender_id, recipient_id),
+                'content': content,
+                'timestamp': _parse_timestamp(record.get('timestamp')),
+                'client_msg_id': record.get('client_msg_id') or None,
+            })
+
+        # Idempotency keys already in the table (e.g. from a previous partial run) are skipped
+        keys = {(row['sender_id'], row['client_msg_id']) for row in rows if row['client_msg_id']}
+        if keys:
+            existing = set(db.session.query(Message.sender_id, Message.client_msg_id).filter(
+                tuple_(Message.sender_id, Message.client_msg_id).in_(list(keys))))
+            kept = []
+            for row in rows:
+                key = (row['sender_id'], row['client_msg_id'])
+                if row['client_msg_id'] and key in existing:
+                    continue
+                existing.add(key)
+                kept.append(row)
+            progress.skipped += len(rows) - len(kept)
+            rows = kept
+
+        if rows:
+            db.session.execute(insert(Message), rows)
+        db.session.commit()
+        progress.inserted += len(rows)
+        checkpoint.save(progress.records)
+        progress.report()
+    return progress
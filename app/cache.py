@@ -0,0 +1,115 @@
+import threading
+import time
+from collections import OrderedDict
+from . import db
+
+
+class CachedUser:
+    # Detached, read-only view of a user row; enough for flask_login and the read APIs
+    __slots__ = ('id', 'username', 'email')
+
+    is_authenticated = True
+    is_active = True
+    is_anonymous = False
+
+    def __init__(self, id, username, email):
+        self.id = id
+        self.username = username
+        self.email = email
+
+    @classmethod
+    def from_model(cls, user):
+        return cls(user.id, user.username, user.email)
+
+    def get_id(self):
+        return str(self.id)
+
+    def __eq__(self, other):
+        return isinstance(other, CachedUser) and self.id == other.id
+
+    def __hash__(self):
+        return hash(self.id)
+
+
+class UserCache:
+    # Bounded LRU of CachedUser records with a TTL. Writes that change a user must call
+    # invalidate(); other processes only see the change once their entry expires.
+
+    def __init__(self, maxsize=10000, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()  # user_id -> (expires_at, CachedUser)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def init_app(self, app):
+        self.maxsize = app.config.get('USER_CACHE_SIZE', self.maxsize)
+        self.ttl = app.config.get('USER_CACHE_TTL', self.ttl)
+
+    def get(self, user_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[0] < now:
+                if entry is not None:
+                    del self._entries[user_id]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, record):
+        with self._lock:
+            self._entries[record.id] = (time.monotonic() + self.ttl, record)
+            self._entries.move_to_end(record.id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+        return record
+
+    def load(self, user_id):
+        record = self.get(user_id)
+        if record is None:
+            from .models.user import User
+
+            user = db.session.get(User, user_id)
+            if user is None:
+                return None
+            record = self.put(CachedUser.from_model(user))
+        return record
+
+    def load_many(self, user_ids):
+        # One IN query for every id that is not cached
+        records = {}
+        missing = []
+        for user_id in user_ids:
+            record = self.get(user_id)
+            if record is None:
+                missing.append(user_id)
+            else:
+                records[user_id] = record
+        if missing:
+            from .models.user import User
+
+            rows = db.session.query(User.id, User.username, User.email).filter(User.id.in_(missing)).all()
+            for row in rows:
+                records[row.id] = self.put(CachedUser(row.id, row.username, row.email))
+        return records
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions, 'size': len(self._entries)}
+
+
+user_cache = UserCache()
@@ -0,0 +1,207 @@
+import os
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import delete, func, insert, literal, or_, select, tuple_, union, union_all, update
+from . import db
+from .archive import message_archive
+from .bulk_import import Checkpoint, import_messages, import_users
+from .models.contact import Contact
+from .models.message import Message
+from .models.conversation import Conversation, SNIPPET_LENGTH
+from .search import search_index
+
+
+def _latest_messages():
+    # Every message belongs to both participants' inboxes; the newest per (user, peer) in
+    # thread order, (timestamp, id), since imported history gets ids above live messages
+    sides = union_all(
+        select(Message.sender_id.label('user_id'), Message.recipient_id.label('peer_id'),
+               Message.id.label('message_id'), Message.timestamp.label('timestamp')),
+        select(Message.recipient_id, Message.sender_id, Message.id, Message.timestamp).where(Message.sender_id != Message.recipient_id),
+    ).subquery()
+    ranked = select(
+        sides.c.user_id,
+        sides.c.peer_id,
+        sides.c.message_id,
+        func.row_number().over(
+            partition_by=(sides.c.user_id, sides.c.peer_id),
+            order_by=(sides.c.timestamp.desc(), sides.c.message_id.desc()),
+        ).label('position'),
+        func.count().over(partition_by=(sides.c.user_id, sides.c.peer_id)).label('message_count'),
+    ).subquery()
+    return (
+        select(ranked.c.user_id, ranked.c.peer_id, ranked.c.message_id, ranked.c.message_count)
+        .where(ranked.c.position == 1)
+        .subquery()
+    )
+
+
+def rebuild_conversations():
+    latest = _latest_messages()
+    # Existing history counts as read so the backfill does not light up every badge
+    rows = select(
+        latest.c.user_id,
+        latest.c.peer_id,
+        Message.id,
+        Message.sender_id,
+        func.substr(Message.content, 1, SNIPPET_LENGTH),
+        Message.timestamp,
+        literal(0),
+        Message.id,
+        latest.c.message_count,
+    ).join(Message, Message.id == latest.c.message_id)
+
+    db.session.execute(delete(Conversation))
+    result = db.session.execute(insert(Conversation).from_select([
+        'user_id', 'peer_id', 'last_message_id', 'last_sender_id', 'last_message_snippet',
+        'last_message_at', 'unread_count', 'last_read_message_id', 'message_count',
+    ], rows))
+    return result.rowcount
+
+
+def merge_conversations():
+    # Folds newly inserted messages into existing inbox rows without touching read state:
+    # last_message_* only moves to a message later in thread order, unread counts and
+    # watermarks are left alone (Conversation.mark_read does not count older history as
+    # unread), and conversations that did not exist yet are added as read
+    latest = _latest_messages()
+    newest = Message.__table__.alias('newest')
+    moved = db.session.execute(
+        update(Conversation)
+        .where(
+            Conversation.user_id == latest.c.user_id,
+            Conversation.peer_id == latest.c.peer_id,
+            newest.c.id == latest.c.message_id,
+            or_(Conversation.last_message_at.is_(None),
+                tuple_(newest.c.timestamp, newest.c.id) > tuple_(Conversation.last_message_at, Conversation.last_message_id)),
+        )
+        .values(
+            last_message_id=newest.c.id,
+            last_sender_id=newest.c.sender_id,
+            last_message_snippet=func.substr(newest.c.content, 1, SNIPPET_LENGTH),
+            last_message_at=newest.c.timestamp,
+        )
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    # Any thread that gained messages gets a new page version, even if its latest message stayed
+    db.session.execute(
+        update(Conversation)
+        .where(
+            Conversation.user_id == latest.c.user_id,
+            Conversation.peer_id == latest.c.peer_id,
+            Conversation.message_count != latest.c.message_count,
+        )
+        .values(message_count=latest.c.message_count)
+        .execution_options(synchronize_session=False)
+    )
+
+    known = select(Conversation.id).where(Conversation.user_id == latest.c.user_id, Conversation.peer_id == latest.c.peer_id)
+    rows = select(
+        latest.c.user_id,
+        latest.c.peer_id,
+        Message.id,
+        Message.sender_id,
+        func.substr(Message.content, 1, SNIPPET_LENGTH),
+        Message.timestamp,
+        literal(0),
+        Message.id,
+        latest.c.message_count,
+    ).join(Message, Message.id == latest.c.message_id).where(~known.exists())
+    added = db.session.execute(insert(Conversation).from_select([
+        'user_id', 'peer_id', 'last_message_id', 'last_sender_id', 'last_message_snippet',
+        'last_message_at', 'unread_count', 'last_read_message_id', 'message_count',
+    ], rows)).rowcount
+    return moved + added
+
+
+def add_missing_contacts():
+    # Everyone a user has exchanged messages with becomes a contact
+    pairs = union(
+        select(Message.sender_id.label('user_id'), Message.recipient_id.label('contact_id')),
+        select(Message.recipient_id, Message.sender_id),
+    ).subquery()
+    known = select(Contact.id).where(Contact.user_id == pairs.c.user_id, Contact.contact_id == pairs.c.contact_id)
+    rows = select(pairs.c.user_id, pairs.c.contact_id).where(pairs.c.user_id != pairs.c.contact_id, ~known.exists())
+    return db.session.execute(insert(Contact).from_select(['user_id', 'contact_id'], rows)).rowcount
+
+
+@click.command('backfill-conversations')
+@with_appcontext
+def backfill_conversations():
+    """Rebuild the conversation summary table from existing messages."""
+    count = rebuild_conversations()
+    db.session.commit()
+    click.echo(f'Backfilled {count} conversation rows')
+
+
+@click.command('rebuild-search-index')
+@with_appcontext
+def rebuild_search_index():
+    """Create (if needed) and repopulate the message search index."""
+    count = search_index.rebuild()
+    db.session.commit()
+    click.echo(f'Indexed {count} messages')
+
+
+@click.command('archive-messages')
+@click.option('--now', type=click.DateTime(), default=None, help='Reference time (UTC) for the tier boundaries.')
+@with_appcontext
+def archive_messages(now):
+    """Move old messages to monthly partitions, freeze old partitions to files and apply retention."""
+    archived, frozen, expired = message_archive.rotate(now)
+    click.echo(f'Archived {archived} messages, froze {frozen} periods, expired {expired} periods')
+
+
+@click.group('import')
+def import_group():
+    """Bulk-load users and messages from CSV or NDJSON files."""
+
+
+@import_group.command('users')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--batch-size', default=10000, show_default=True, help='Records per INSERT batch and commit.')
+@click.option('--workers', default=os.cpu_count() or 1, show_default=True, help='Password hashing processes.')
+@click.option('--hash-method', default=None, help='Werkzeug hash method; defaults to PASSWORD_HASH_METHOD. '
+              'Cheaper methods are upgraded on the next login.')
+@click.option('--restart', is_flag=True, help='Ignore the saved checkpoint and start from the first record.')
+@with_appcontext
+def import_users_command(path, batch_size, workers, hash_method, restart):
+    """Import users (username, email, password or password_hash)."""
+    checkpoint = Checkpoint(path + '.progress', restart)
+    if checkpoint.done:
+        click.echo(f'Resuming after record {checkpoint.done}')
+    method = hash_method or current_app.config.get('PASSWORD_HASH_METHOD', 'scrypt')
+    progress = import_users(path, batch_size, workers, method, checkpoint, click.echo)
+    checkpoint.clear()
+    click.echo(f'Done: {progress.inserted} users inserted, {progress.skipped} skipped')
+
+
+@import_group.command('messages')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--batch-size', default=50000, show_default=True, help='Records per INSERT batch and commit.')
+@click.option('--rebuild/--no-rebuild', default=True, show_default=True,
+              help='Fold the messages into conversation summaries, contacts and the search index afterwards.')
+@click.option('--restart', is_flag=True, help='Ignore the saved checkpoint and start from the first record.')
+@with_appcontext
+def import_messages_command(path, batch_size, rebuild, restart):
+    """Import messages (sender/recipient usernames or ids, content, timestamp, client_msg_id)."""
+    checkpoint = Checkpoint(path + '.progress', restart)
+    if checkpoint.done:
+        click.echo(f'Resuming after record {checkpoint.done}')
+    progress = import_messages(path, batch_size, checkpoint, click.echo)
+    if rebuild:
+        click.echo('Updating conversations, contacts and search index')
+        merge_conversations()
+        add_missing_contacts()
+        search_index.rebuild()
+        db.session.commit()
+    checkpoint.clear()
+    click.echo(f'Done: {progress.inserted} messages inserted, {progress.skipped} skipped')
+
+
+def init_app(app):
+    app.cli.add_command(backfill_conversations)
+    app.cli.add_command(rebuild_search_index)
+    app.cli.add_command(archive_messages)
+    app.cli.add_command(import_group)
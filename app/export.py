@@ -0,0 +1,51 @@
+import csv
+import io
+import json
+import zlib
+
+EXPORT_COLUMNS = ('id', 'sender_id', 'recipient_id', 'timestamp', 'content')
+CHUNK_SIZE = 64 * 1024
+
+
+def _ndjson_lines(rows):
+    for row in rows:
+        record = dict(zip(EXPORT_COLUMNS, row))
+        record['timestamp'] = record['timestamp'].isoformat()
+        yield json.dumps(record, ensure_ascii=False) + '\n'
+
+
+def _csv_lines(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for row in rows:
+        writer.writerow(row[:3] + (row[3].isoformat(),) + row[4:])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def export_chunks(rows, fmt):
+    # rows is any iterator of EXPORT_COLUMNS tuples; output is re-chunked to ~CHUNK_SIZE
+    lines = _csv_lines(rows) if fmt == 'csv' else _ndjson_lines(rows)
+    pending = []
+    size = 0
+    for line in lines:
+        pending.append(line)
+        size += len(line)
+        if size >= CHUNK_SIZE:
+            yield ''.join(pending).encode()
+            pending = []
+            size = 0
+    if pending:
+        yield ''.join(pending).encode()
+
+
+def gzip_chunks(chunks):
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits=31 writes a gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
@@ -0,0 +1,122 @@
+import sys
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from werkzeug.security import check_password_hash, generate_password_hash
+
+
+class HasherBusy(Exception):
+    pass
+
+
+def _green_runtime():
+    # 'eventlet' or 'gevent' when the process is monkey-patched: a KDF call there would
+    # block every greenlet on the hub, not just the requesting one
+    if 'eventlet' in sys.modules:
+        from eventlet import patcher
+        if patcher.is_monkey_patched('thread'):
+            return 'eventlet'
+    if 'gevent' in sys.modules:
+        from gevent import monkey
+        if monkey.is_module_patched('threading'):
+            return 'gevent'
+    return None
+
+
+class PasswordHasher:
+    # Runs the password KDF on at most PASSWORD_HASH_WORKERS native threads (or processes),
+    # so a burst of logins cannot take every core from the other requests. With pool 'auto'
+    # a monkey-patched eventlet/gevent server uses native threads its hub can wait on without
+    # blocking other greenlets; a threaded server uses a plain thread pool. At most
+    # PASSWORD_HASH_QUEUE_SIZE jobs wait or run at once.
+
+    def __init__(self):
+        self.method = 'scrypt'
+        self.pool = 'auto'
+        self.workers = 4
+        self.queue_size = 64
+        self.queue_timeout = 2.0
+        self.mode = 'inline'
+        self._executor = None
+        self._slots = None
+        self._running = None
+        self._prefix = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.method = app.config.get('PASSWORD_HASH_METHOD', self.method)
+        self.pool = app.config.get('PASSWORD_HASH_POOL', self.pool)
+        self.workers = app.config.get('PASSWORD_HASH_WORKERS', self.workers)
+        self.queue_size = app.config.get('PASSWORD_HASH_QUEUE_SIZE', self.queue_size)
+        self.queue_timeout = app.config.get('PASSWORD_HASH_QUEUE_TIMEOUT', self.queue_timeout)
+        self.shutdown()
+        self._prefix = None
+        if not self.workers:
+            self.mode = 'inline'
+        elif self.pool == 'auto':
+            self.mode = _green_runtime() or 'thread'
+        elif self.pool in ('thread', 'process'):
+            self.mode = self.pool
+        else:
+            raise ValueError(f'Unknown PASSWORD_HASH_POOL {self.pool!r}')
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, pwhash, password):
+        return self._run(check_password_hash, pwhash, password)
+
+    def needs_rehash(self, pwhash):
+        # Werkzeug stores "method:params$salt$hash"; anything not made with today's params is stale
+        if self._prefix is None:
+            self._prefix = self.hash('').split('$', 1)[0]
+        return pwhash.split('$', 1)[0] != self._prefix
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+            self._executor = None
+            self._slots = None
+            self._running = None
+
+    def _run(self, fn, *args):
+        if self.mode == 'inline':
+            return fn(*args)
+        executor, slots = self._ensure_executor()
+        if not slots.acquire(timeout=self.queue_timeout):
+            raise HasherBusy('Too many password hashes in flight')
+        # Released by the caller, not a done-callback: under gevent those run on the hub,
+        # where a (patched) semaphore may not block
+        try:
+            if executor is None:
+                return self._run_on_hub(fn, args)
+            return executor.submit(fn, *args).result()
+        finally:
+            slots.release()
+
+    def _run_on_hub(self, fn, args):
+        # eventlet's shared native threadpool; only the calling greenlet waits for the result,
+        # and the semaphore keeps hashes to PASSWORD_HASH_WORKERS of its threads
+        from eventlet import tpool
+        with self._running:
+            return tpool.execute(fn, *args)
+
+    def _ensure_executor(self):
+        # (executor or None for eventlet's threadpool, slot semaphore), created on first use
+        with self._lock:
+            if self._slots is None:
+                if self.mode == 'process':
+                    self._executor = ProcessPoolExecutor(max_workers=self.workers)
+                elif self.mode == 'gevent':
+                    # Native threads whose futures a greenlet can wait on cooperatively
+                    from gevent.threadpool import ThreadPoolExecutor as GeventThreadPoolExecutor
+                    self._executor = GeventThreadPoolExecutor(max_workers=self.workers)
+                elif self.mode == 'thread':
+                    self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='password-hash')
+                else:
+                    self._running = threading.BoundedSemaphore(self.workers)
+                self._slots = threading.BoundedSemaphore(self.queue_size)
+            return self._executor, self._slots
+
+
+password_hasher = PasswordHasher()
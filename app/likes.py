@@ -0,0 +1,90 @@
+import atexit
+import threading
+from collections import Counter
+from sqlalchemy import update
+from . import db
+
+
+def increment_likes(message_id, delta=1):
+    # Single atomic UPDATE; concurrent increments never overwrite each other
+    from .models.message import Message
+
+    db.session.execute(update(Message).where(Message.id == message_id).values(likes=Message.likes + delta))
+
+
+class LikeAggregator:
+    # Buffers like increments in memory and applies them as one UPDATE per message
+    # every LIKE_FLUSH_INTERVAL seconds, so a hot message takes one write per interval.
+
+    def __init__(self):
+        self.app = None
+        self.enabled = False
+        self.interval = 1.0
+        self._deltas = Counter()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopped = threading.Event()
+
+    def init_app(self, app):
+        # Re-initialising (another app in the same process) flushes the old app's buffered likes
+        # and stops its thread; the next add() starts a fresh one bound to the new app
+        if self.app is not None:
+            self.shutdown()
+        self._thread = None
+        self._stopped = threading.Event()
+        self.app = app
+        self.enabled = app.config.get('LIKE_AGGREGATION', False)
+        self.interval = app.config.get('LIKE_FLUSH_INTERVAL', self.interval)
+        if self.enabled:
+            atexit.register(self.shutdown)
+
+    def add(self, message_id, delta=1):
+        with self._lock:
+            self._deltas[message_id] += delta
+        self._ensure_thread()
+
+    def pending(self, message_id):
+        with self._lock:
+            return self._deltas.get(message_id, 0)
+
+    def flush(self):
+        with self._lock:
+            deltas, self._deltas = self._deltas, Counter()
+        if not deltas:
+            return 0
+        try:
+            for message_id, delta in deltas.items():
+                increment_likes(message_id, delta)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            # Put the deltas back so the next flush retries them
+            with self._lock:
+                self._deltas.update(deltas)
+            raise
+        return len(deltas)
+
+    def shutdown(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+        with self.app.app_context():
+            self.flush()
+
+    def _ensure_thread(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='like-aggregator', daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                with self.app.app_context():
+                    self.flush()
+            except Exception:
+                self.app.logger.exception('Like flush failed')
+
+
+like_aggregator = LikeAggregator()
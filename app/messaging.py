@@ -0,0 +1,96 @@
+from datetime import datetime
+from sqlalchemy import tuple_
+from sqlalchemy.exc import IntegrityError
+from . import db
+from .models.message import Message
+from .models.conversation import Conversation
+from .search import search_index
+
+MAX_CONTENT_LENGTH = 500
+MAX_CLIENT_MSG_ID_LENGTH = 64
+
+
+class InvalidMessage(ValueError):
+    pass
+
+
+def build_message_row(sender_id, data):
+    # Validates a send request (HTTP body or socket event) into an insertable row
+    from .cache import user_cache
+
+    if not isinstance(data, dict):
+        raise InvalidMessage('Invalid data')
+    recipient_id = data.get('recipient_id')
+    if recipient_id is None:
+        raise InvalidMessage('Recipient ID is required')
+    try:
+        recipient_id = int(recipient_id)
+    except (TypeError, ValueError):
+        raise InvalidMessage('Recipient ID must be an integer')
+    content = data.get('content')
+    if not isinstance(content, str) or not content.strip():
+        raise InvalidMessage('Content is required')
+    if len(content) > MAX_CONTENT_LENGTH:
+        raise InvalidMessage(f'Content is longer than {MAX_CONTENT_LENGTH} characters')
+    client_msg_id = data.get('client_msg_id')
+    if client_msg_id is not None and (not isinstance(client_msg_id, str) or not 0 < len(client_msg_id) <= MAX_CLIENT_MSG_ID_LENGTH):
+        raise InvalidMessage(f'client_msg_id must be a string of 1-{MAX_CLIENT_MSG_ID_LENGTH} characters')
+    if user_cache.load(recipient_id) is None:
+        raise InvalidMessage('Recipient not found')
+    return {
+        'sender_id': sender_id,
+        'recipient_id': recipient_id,
+        'content': content,
+        'client_msg_id': client_msg_id,
+        'timestamp': datetime.utcnow(),
+    }
+
+
+def _stored(message):
+    return {'id': message.id, 'content': message.content, 'sender_id': message.sender_id,
+            'recipient_id': message.recipient_id, 'timestamp': message.timestamp, 'client_msg_id': message.client_msg_id}
+
+
+def _persist(rows):
+    # Rows whose (sender_id, client_msg_id) was already stored resolve to the stored message
+    keys = {(row['sender_id'], row['client_msg_id']) for row in rows if row.get('client_msg_id')}
+    known = {}
+    if keys:
+        existing = Message.query.filter(tuple_(Message.sender_id, Message.client_msg_id).in_(list(keys)))
+        known = {(message.sender_id, message.client_msg_id): message for message in existing}
+    results = []
+    new = []
+    for row in rows:
+        key = (row['sender_id'], row.get('client_msg_id'))
+        if key in known:
+            results.append((known[key], True))
+            continue
+        message = Message(**row)
+        new.append(message)
+        results.append((message, False))
+        if key[1]:
+            known[key] = message
+    if new:
+        db.session.add_all(new)
+        db.session.flush()
+        for message in new:
+            Conversation.record_message(message)
+        search_index.add(new)
+    return [(_stored(message), duplicate) for message, duplicate in results]
+
+
+def store_messages(rows):
+    # Inserts rows in one transaction and returns (stored message fields, duplicate) per row;
+    # a duplicate resolves to the message stored first, not to the retry's fields
+    try:
+        results = _persist(rows)
+        db.session.commit()
+        return results
+    except IntegrityError:
+        db.session.rollback()
+        if len(rows) == 1:
+            # A concurrent retry with the same client id won the race; now it is visible
+            results = _persist(rows)
+            db.session.commit()
+            return results
+        return [store_messages([row])[0] for row in rows]
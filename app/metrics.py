@@ -0,0 +1,265 @@
+import bisect
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter as _Tally
+from flask import Response, g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 250)
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    pairs = ','.join('{}="{}"'.format(name, str(value).replace('\\', r'\\').replace('"', r'\"')) for name, value in zip(names, values))
+    return '{' + pairs + '}'
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple(labels.get(name, '') for name in self.labelnames)
+
+    def header(self):
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set_total(self, value, **labels):
+        # For totals kept elsewhere (e.g. cache stats) and copied in at scrape time
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def render(self):
+        with self._lock:
+            items = list(self._values.items())
+        return self.header() + [f'{self.name}{_format_labels(self.labelnames, key)} {value}' for key, value in items]
+
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        self.set_total(value, **labels)
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0, 0.0]
+            if index < len(self.buckets):
+                state[0][index] += 1
+            state[1] += 1
+            state[2] += value
+
+    def render(self):
+        with self._lock:
+            items = [(key, (list(counts), total, sum_)) for key, (counts, total, sum_) in self._values.items()]
+        lines = self.header()
+        names = self.labelnames + ('le',)
+        for key, (counts, total, sum_) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{_format_labels(names, key + (bound,))} {cumulative}')
+            lines.append(f'{self.name}_bucket{_format_labels(names, key + ("+Inf",))} {total}')
+            lines.append(f'{self.name}_count{_format_labels(self.labelnames, key)} {total}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labelnames, key)} {sum_}')
+        return lines
+
+
+request_latency = Histogram('http_request_duration_seconds', 'HTTP request latency by endpoint.', ('endpoint', 'method', 'status'))
+request_statements = Histogram('http_request_db_statements', 'SQL statements executed per HTTP request.', ('endpoint',), COUNT_BUCKETS)
+request_db_time = Histogram('http_request_db_seconds', 'Time spent in SQL per HTTP request.', ('endpoint',))
+db_statements = Counter('db_statements_total', 'SQL statements executed, in and out of requests.')
+db_statement_time = Counter('db_statement_seconds_total', 'Total time spent executing SQL statements.')
+n_plus_one_warnings = Counter('db_n_plus_one_warnings_total', 'Requests whose statement count crossed the N+1 threshold.', ('endpoint',))
+pool_checkout_wait = Histogram('db_pool_checkout_wait_seconds', 'Time spent waiting for a pooled DB connection.')
+socketio_emits = Counter('socketio_emits_total', 'Socket.IO events emitted by the server.', ('event',))
+socketio_connects = Counter('socketio_connects_total', 'Accepted Socket.IO connections.')
+socketio_connections = Gauge('socketio_connections', 'Currently open Socket.IO connections in this process.')
+user_cache_lookups = Counter('user_cache_lookups_total', 'User cache lookups by result.', ('result',))
+
+REGISTRY = [
+    request_latency, request_statements, request_db_time, db_statements, db_statement_time,
+    n_plus_one_warnings, pool_checkout_wait, socketio_emits, socketio_connects, socketio_connections,
+    user_cache_lookups,
+]
+
+
+def render_metrics():
+    from .cache import user_cache
+
+    stats = user_cache.stats()
+    user_cache_lookups.set_total(stats['hits'], result='hit')
+    user_cache_lookups.set_total(stats['misses'], result='miss')
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+class TimedQueuePool(QueuePool):
+    # QueuePool that records how long each checkout waited (including opening new connections)
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            pool_checkout_wait.observe(time.perf_counter() - start)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # One slot per connection, not a stack: a failed statement never reaches after_cursor_execute,
+    # so anything pushed here would stay on the pooled connection forever
+    conn.info['query_start'] = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = conn.info.pop('query_start', None)
+    if start is None:
+        return
+    elapsed = time.perf_counter() - start
+    db_statements.inc()
+    db_statement_time.inc(elapsed)
+    if has_request_context() and 'db_statements' in g:
+        g.db_statements += 1
+        g.db_time += elapsed
+
+
+class SamplingProfiler:
+    # Samples one thread's stack every `interval` seconds and keeps folded stack counts,
+    # the input format of flamegraph.pl and speedscope
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = _Tally()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})')
+                frame = frame.f_back
+            if names:
+                self.stacks[';'.join(reversed(names))] += 1
+
+    def dump(self, path):
+        with open(path, 'w') as f:
+            for stack, count in self.stacks.items():
+                f.write(f'{stack} {count}\n')
+
+
+def _with_timed_pool(options):
+    # Swap in the timed pool wherever SQLAlchemy would use a QueuePool anyway
+    uri = str(options.get('url', ''))
+    in_memory_sqlite = uri.startswith('sqlite') and (':memory:' in uri or uri.rstrip('/') == 'sqlite:')
+    if 'poolclass' not in options and not in_memory_sqlite:
+        options['poolclass'] = TimedQueuePool
+    return options
+
+
+def _configure_pool(app):
+    options = dict(app.config.get('SQLALCHEMY_ENGINE_OPTIONS') or {}, url=app.config.get('SQLALCHEMY_DATABASE_URI', ''))
+    options = _with_timed_pool(options)
+    del options['url']
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = options
+    binds = {}
+    for key, bind in (app.config.get('SQLALCHEMY_BINDS') or {}).items():
+        bind = dict(bind) if isinstance(bind, dict) else {'url': bind}
+        binds[key] = _with_timed_pool(bind)
+    app.config['SQLALCHEMY_BINDS'] = binds
+
+
+def init_app(app):
+    # Must run before db.init_app so the pool class reaches the engine
+    if not app.config.get('METRICS_ENABLED', True):
+        return
+    _configure_pool(app)
+    threshold = app.config.get('METRICS_N_PLUS_ONE_THRESHOLD', 20)
+    profile_slow = app.config.get('PROFILE_SLOW_REQUEST_SECONDS')
+    profile_interval = app.config.get('PROFILE_SAMPLE_INTERVAL', 0.005)
+    profile_dir = app.config.get('PROFILE_DIR', 'profiles')
+
+    @app.before_request
+    def _start_request():
+        g.request_start = time.perf_counter()
+        g.db_statements = 0
+        g.db_time = 0.0
+        if profile_slow is not None:
+            g.profiler = SamplingProfiler(threading.get_ident(), profile_interval).start()
+
+    @app.after_request
+    def _finish_request(response):
+        if 'request_start' not in g:
+            return response
+        elapsed = time.perf_counter() - g.request_start
+        endpoint = request.endpoint or 'unmatched'
+        request_latency.observe(elapsed, endpoint=endpoint, method=request.method, status=response.status_code)
+        request_statements.observe(g.db_statements, endpoint=endpoint)
+        request_db_time.observe(g.db_time, endpoint=endpoint)
+        if g.db_statements > threshold:
+            n_plus_one_warnings.inc(endpoint=endpoint)
+            logger.warning('%s ran %d SQL statements (threshold %d); possible N+1 query', endpoint, g.db_statements, threshold)
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            profiler.stop()
+            if elapsed >= profile_slow:
+                os.makedirs(profile_dir, exist_ok=True)
+                path = os.path.join(profile_dir, f'{int(time.time() * 1000)}-{endpoint}.folded')
+                profiler.dump(path)
+                logger.warning('%s took %.3fs; profile written to %s', endpoint, elapsed, path)
+        return response
+
+    app.add_url_rule('/metrics', 'metrics', lambda: Response(render_metrics(), mimetype='text/plain; version=0.0.4'))
@@ -2,3 +2,7 @@ from .. import db
 from .user import User
 from .message import Message
 from .contact import Contact
+from .conversation import Conversation
+from .message_like import MessageLike
+from .message_period import MessagePeriod
+from .message_period_conversation import MessagePeriodConversation
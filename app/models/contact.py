@@ -2,6 +2,11 @@ from .. import db
 
 class Contact(db.Model):
     __tablename__ = 'contact'
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'contact_id', name='uq_contact_user_contact'),
+        # Reverse lookup: who has this user in their list (presence fan-out)
+        db.Index('ix_contact_contact_id', 'contact_id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
@@ -0,0 +1,106 @@
+from sqlalchemy import case, or_, tuple_, update
+from sqlalchemy.exc import IntegrityError
+from .. import db
+from .message import Message, make_conversation_key
+
+SNIPPET_LENGTH = 100
+# Columns that describe the newest message; concurrent sends commit in any order, so an
+# update only applies them when its message id is higher than the one already stored
+LATEST_COLUMNS = ('last_message_id', 'last_sender_id', 'last_message_snippet', 'last_message_at')
+
+
+class Conversation(db.Model):
+    # One inbox row per (user, peer), kept in step with the message table
+    __tablename__ = 'conversation'
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'peer_id', name='uq_conversation_user_peer'),
+        db.Index('ix_conversation_user_last_message_at', 'user_id', 'last_message_at', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    peer_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    last_message_id = db.Column(db.Integer)
+    last_sender_id = db.Column(db.Integer)
+    last_message_snippet = db.Column(db.String(SNIPPET_LENGTH))
+    last_message_at = db.Column(db.DateTime)
+    unread_count = db.Column(db.Integer, nullable=False, default=0)
+    last_read_message_id = db.Column(db.Integer, nullable=False, default=0)
+    # Bumped for every message recorded in the thread, whatever order sends commit in;
+    # GET /api/messages uses it as the version of the thread's pages
+    message_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+    def __repr__(self):
+        return f'<Conversation {self.user_id} with {self.peer_id}>'
+
+    @classmethod
+    def record_message(cls, message):
+        # Runs inside the caller's transaction; the message must already be flushed so it has an id
+        sides = [(message.sender_id, message.recipient_id)]
+        if message.sender_id != message.recipient_id:
+            sides.append((message.recipient_id, message.sender_id))
+        for user_id, peer_id in sides:
+            values = {
+                'last_message_id': message.id,
+                'last_sender_id': message.sender_id,
+                'last_message_snippet': message.content[:SNIPPET_LENGTH],
+                'last_message_at': message.timestamp,
+                'message_count': cls.message_count + 1,
+            }
+            if user_id == message.sender_id:
+                # Writing into a thread means the sender has seen everything up to here
+                values.update(unread_count=0, last_read_message_id=message.id)
+            else:
+                values['unread_count'] = cls.unread_count + 1
+            if not cls._update_row(user_id, peer_id, values):
+                cls._insert_row(user_id, peer_id, values)
+
+    @classmethod
+    def _update_row(cls, user_id, peer_id, values):
+        newer = or_(cls.last_message_id.is_(None), cls.last_message_id < values['last_message_id'])
+        guarded = {
+            name: case((newer, value), else_=getattr(cls, name)) if name in LATEST_COLUMNS else value
+            for name, value in values.items()
+        }
+        if 'last_read_message_id' in values:
+            # The read watermark only moves forward as well
+            watermark = values['last_read_message_id']
+            guarded['last_read_message_id'] = case((cls.last_read_message_id < watermark, watermark), else_=cls.last_read_message_id)
+        result = db.session.execute(
+            update(cls).where(cls.user_id == user_id, cls.peer_id == peer_id).values(**guarded)
+        )
+        return result.rowcount > 0
+
+    @classmethod
+    def _insert_row(cls, user_id, peer_id, values):
+        row = dict(values, user_id=user_id, peer_id=peer_id, message_count=1)
+        if 'last_read_message_id' not in row:
+            row.update(unread_count=1, last_read_message_id=0)
+        try:
+            with db.session.begin_nested():
+                db.session.add(cls(**row))
+        except IntegrityError:
+            # Another request created the row first; apply the update to it instead
+            cls._update_row(user_id, peer_id, values)
+
+    @classmethod
+    def mark_read(cls, user_id, peer_id, message_id):
+        # Watermarks only move forward; unread is recounted from the peer's messages after it in
+        # thread order, so imported history (high ids, old timestamps) never shows up as unread
+        query = Message.query.filter(
+            Message.conversation_key == make_conversation_key(user_id, peer_id),
+            Message.sender_id == peer_id,
+        )
+        read_at = db.session.query(Message.timestamp).filter(Message.id == message_id).scalar()
+        if read_at is None:
+            # The watermark message has been archived; ids are the only position left
+            query = query.filter(Message.id > message_id)
+        else:
+            query = query.filter(tuple_(Message.timestamp, Message.id) > tuple_(read_at, message_id))
+        unread = query.count()
+        result = db.session.execute(
+            update(cls)
+            .where(cls.user_id == user_id, cls.peer_id == peer_id, cls.last_read_message_id < message_id)
+            .values(last_read_message_id=message_id, unread_count=unread)
+        )
+        return result.rowcount > 0
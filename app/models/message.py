@@ -1,14 +1,38 @@
 from .. import db
 from datetime import datetime
 
+
+def make_conversation_key(user_a, user_b):
+    # Both directions of a thread share one key so it can be served from one index range
+    low, high = sorted((int(user_a), int(user_b)))
+    return f'{low}:{high}'
+
+
 class Message(db.Model):
     __tablename__ = 'message'
+    __table_args__ = (
+        db.Index('ix_message_conversation_timestamp_id', 'conversation_key', 'timestamp', 'id'),
+        # Per-user id ranges for delta sync
+        db.Index('ix_message_sender_id_id', 'sender_id', 'id'),
+        db.Index('ix_message_recipient_id_id', 'recipient_id', 'id'),
+        # Client-supplied idempotency key: a retried send maps back to the stored message
+        db.UniqueConstraint('sender_id', 'client_msg_id', name='uq_message_sender_client_msg_id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     content = db.Column(db.String(500), nullable=False)
     sender_id = db.Column(db.Integer, db.ForeignKey('user.id'))
     recipient_id = db.Column(db.Integer, db.ForeignKey('user.id'))
+    conversation_key = db.Column(db.String(41), nullable=False)
+    client_msg_id = db.Column(db.String(64), nullable=True)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    # Denormalized count of message_like rows, only ever changed with likes = likes + n
+    likes = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        if self.conversation_key is None and self.sender_id is not None and self.recipient_id is not None:
+            self.conversation_key = make_conversation_key(self.sender_id, self.recipient_id)
 
     def __repr__(self):
         return f'<Message {self.content} from {self.sender_id} to {self.recipient_id}>'
@@ -0,0 +1,13 @@
+from .. import db
+from datetime import datetime
+
+class MessageLike(db.Model):
+    __tablename__ = 'message_like'
+    __table_args__ = (
+        db.UniqueConstraint('message_id', 'user_id', name='uq_message_like_message_user'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    message_id = db.Column(db.Integer, db.ForeignKey('message.id'), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    timestamp = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
@@ -0,0 +1,23 @@
+from .. import db
+from datetime import datetime
+
+
+class MessagePeriod(db.Model):
+    # Catalog of archived months: 'warm' rows live in a per-month table (a native partition
+    # on PostgreSQL), 'cold' rows in a gzip NDJSON file under MESSAGE_ARCHIVE_DIR
+    __tablename__ = 'message_period'
+
+    id = db.Column(db.Integer, primary_key=True)
+    period = db.Column(db.String(7), unique=True, nullable=False)
+    tier = db.Column(db.String(8), nullable=False, default='warm')
+    table_name = db.Column(db.String(64))
+    path = db.Column(db.String(255))
+    starts_at = db.Column(db.DateTime, nullable=False)
+    ends_at = db.Column(db.DateTime, nullable=False)
+    row_count = db.Column(db.Integer, nullable=False, default=0)
+    first_id = db.Column(db.Integer)
+    last_id = db.Column(db.Integer)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    def __repr__(self):
+        return f'<MessagePeriod {self.period} ({self.tier})>'
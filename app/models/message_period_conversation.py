@@ -0,0 +1,17 @@
+from .. import db
+
+
+class MessagePeriodConversation(db.Model):
+    # Which archived months hold messages of a conversation, so history reads visit only those
+    __tablename__ = 'message_period_conversation'
+    __table_args__ = (
+        db.UniqueConstraint('conversation_key', 'period_id', name='uq_message_period_conversation_key_period'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    period_id = db.Column(db.Integer, db.ForeignKey('message_period.id'), nullable=False)
+    conversation_key = db.Column(db.String(41), nullable=False)
+    row_count = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<MessagePeriodConversation {self.conversation_key} in {self.period_id}>'
@@ -0,0 +1,27 @@
+import base64
+import binascii
+from datetime import datetime
+
+
+def encode_cursor(timestamp, message_id):
+    raw = f'{timestamp.isoformat()}|{message_id}'.encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    # Raises ValueError for anything that was not produced by encode_cursor
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        timestamp, message_id = base64.urlsafe_b64decode(padded).decode().split('|')
+        return datetime.fromisoformat(timestamp), int(message_id)
+    except (TypeError, UnicodeDecodeError, binascii.Error) as e:
+        raise ValueError(f'Invalid cursor: {cursor!r}') from e
+
+
+def parse_limit(value, default, maximum):
+    if value is None:
+        return default
+    limit = int(value)
+    if limit < 1:
+        raise ValueError('limit must be positive')
+    return min(limit, maximum)
@@ -0,0 +1,125 @@
+import threading
+import time
+from collections import defaultdict
+from .metrics import socketio_emits
+
+
+def user_room(user_id):
+    return f'user_{user_id}'
+
+
+class PresenceRegistry:
+    # Tracks live sockets per user in this process. State changes are coalesced and
+    # pushed in batches to the users who have the changed user in their contacts.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._last_seen = {}  # sid -> monotonic time of last connect/heartbeat
+        self._sid_user = {}
+        self._user_sids = defaultdict(set)
+        self._pending = set()
+        self._published = set()  # users last announced as online
+        self._worker = None
+        self.app = None
+        self.socketio = None
+        self.ttl = 90
+        self.debounce = 2.0
+
+    def init_app(self, app, socketio):
+        self.app = app
+        self.socketio = socketio
+        self.ttl = app.config.get('PRESENCE_TTL', self.ttl)
+        self.debounce = app.config.get('PRESENCE_DEBOUNCE', self.debounce)
+
+    def connect(self, user_id, sid):
+        with self._lock:
+            self._sid_user[sid] = user_id
+            self._user_sids[user_id].add(sid)
+            self._last_seen[sid] = time.monotonic()
+            self._pending.add(user_id)
+        self._ensure_worker()
+
+    def heartbeat(self, sid):
+        with self._lock:
+            if sid in self._sid_user:
+                self._last_seen[sid] = time.monotonic()
+
+    def disconnect(self, sid):
+        with self._lock:
+            self._drop(sid)
+
+    def is_online(self, user_id):
+        return bool(self._user_sids.get(user_id))
+
+    def status(self, user_id):
+        return 'online' if self.is_online(user_id) else 'offline'
+
+    def expire(self, now=None):
+        deadline = (now if now is not None else time.monotonic()) - self.ttl
+        with self._lock:
+            for sid in [sid for sid, seen in self._last_seen.items() if seen < deadline]:
+                self._drop(sid)
+
+    def _drop(self, sid):
+        user_id = self._sid_user.pop(sid, None)
+        self._last_seen.pop(sid, None)
+        if user_id is None:
+            return
+        sids = self._user_sids[user_id]
+        sids.discard(sid)
+        if not sids:
+            del self._user_sids[user_id]
+            self._pending.add(user_id)
+
+    def collect_changes(self):
+        # Flapping inside one debounce window collapses to nothing if the user ends where they started
+        with self._lock:
+            pending, self._pending = self._pending, set()
+            changes = {}
+            for user_id in pending:
+                status = 'online' if self._user_sids.get(user_id) else 'offline'
+                if (user_id in self._published) == (status == 'online'):
+                    continue
+                changes[user_id] = status
+                if status == 'online':
+                    self._published.add(user_id)
+                else:
+                    self._published.discard(user_id)
+            return changes
+
+    def flush(self):
+        from .models.contact import Contact
+
+        changes = self.collect_changes()
+        if not changes:
+            return 0
+        watchers = Contact.query.with_entities(Contact.user_id, Contact.contact_id).filter(
+            Contact.contact_id.in_(list(changes))
+        ).all()
+        batches = defaultdict(list)
+        for watcher_id, contact_id in watchers:
+            if self.is_online(watcher_id):
+                batches[watcher_id].append({'id': contact_id, 'status': changes[contact_id]})
+        for watcher_id, batch in batches.items():
+            self.socketio.emit('presence', {'contacts': batch}, to=user_room(watcher_id))
+            socketio_emits.inc(event='presence')
+        return len(batches)
+
+    def _ensure_worker(self):
+        if self._worker is None and self.socketio is not None:
+            with self._lock:
+                if self._worker is None:
+                    self._worker = self.socketio.start_background_task(self._run)
+
+    def _run(self):
+        while True:
+            self.socketio.sleep(self.debounce)
+            try:
+                self.expire()
+                with self.app.app_context():
+                    self.flush()
+            except Exception:
+                self.app.logger.exception('Presence flush failed')
+
+
+presence = PresenceRegistry()
@@ -0,0 +1,56 @@
+import gzip
+import hashlib
+from flask import Response, request
+
+JSON_MIMETYPE = 'application/json'
+
+
+def version_etag(*parts):
+    # Cheap weak validator built from version stamps, not from the response body
+    return hashlib.sha1('|'.join(str(part) for part in parts).encode()).hexdigest()
+
+
+def not_modified(etag):
+    response = Response(status=304)
+    response.set_etag(etag, weak=True)
+    return response
+
+
+def is_fresh(etag):
+    return request.if_none_match.contains_weak(etag)
+
+
+def json_bytes_response(body, etag=None):
+    response = Response(body, mimetype=JSON_MIMETYPE)
+    if etag is not None:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def compress_response(response, min_size, level):
+    if (
+        response.direct_passthrough
+        or response.status_code < 200
+        or response.status_code in (204, 304)
+        or 'Content-Encoding' in response.headers
+        or response.mimetype not in (JSON_MIMETYPE, 'text/html', 'text/csv')
+    ):
+        return response
+    response.vary.add('Accept-Encoding')
+    if request.accept_encodings['gzip'] <= 0 or response.is_streamed:
+        return response
+    body = response.get_data()
+    if len(body) < min_size:
+        return response
+    response.set_data(gzip.compress(body, compresslevel=level))
+    response.headers['Content-Encoding'] = 'gzip'
+    return response
+
+
+def init_app(app):
+    min_size = app.config.get('COMPRESS_MIN_SIZE', 1024)
+    level = app.config.get('COMPRESS_LEVEL', 6)
+
+    @app.after_request
+    def _compress(response):
+        return compress_response(response, min_size, level)
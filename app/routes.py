@@ -1,13 +1,34 @@
-from flask import Blueprint, jsonify, request, redirect, url_for
+from flask import Blueprint, jsonify, request, redirect, url_for, current_app, render_template, Response, stream_with_context
+from sqlalchemy import or_, select, tuple_
 from sqlalchemy.exc import IntegrityError
 from . import socketio, db
 from .models.user import User
-from .models.message import Message
+from .models.message import Message, make_conversation_key
+from .models.conversation import Conversation
+from .models.contact import Contact
+from .models.message_like import MessageLike
+from .pagination import encode_cursor, decode_cursor, parse_limit
+from .presence import presence, user_room
+from .writer import message_writer, WriterBusy
+from .likes import like_aggregator, increment_likes
+from .cache import user_cache, CachedUser
+from .hashing import HasherBusy
+from .search import search_index
+from .export import export_chunks, gzip_chunks
+from .archive import message_archive
+from .serialization import message_fragments
+from .responses import version_etag, is_fresh, not_modified, json_bytes_response
+from .sync import changes_since
+from .messaging import build_message_row, store_messages, InvalidMessage
+from . import metrics
+from .routing import read_only, pin_to_primary
 from flask_login import login_user, logout_user, login_required, current_user
 from flask_cors import cross_origin
+from flask_socketio import join_room, emit
 import logging
-
-logging.basicConfig(level=logging.DEBUG)
+from datetime import datetime
+from itertools import chain
+from concurrent.futures import TimeoutError as FutureTimeoutError
 
 main = Blueprint('main', __name__)
 
@@ -19,7 +40,6 @@ def index():
 @cross_origin(origins=["http://localhost:3000"], supports_credentials=True)
 def signup():
     data = request.get_json()
-    logging.debug(f"Received signup data: {data}")
     if not data:
         return jsonify({"error": "Invalid data"}), 400
 
@@ -37,6 +57,8 @@ def signup():
     if email and User.query.filter_by(email=email).first():
         return jsonify({"error": "Email already exists"}), 400
 
+    # End the read transaction before the KDF so signups waiting on the hasher do not hold pooled connections
+    db.session.rollback()
     try:
         new_user = User(username=username, email=email)
         new_user.set_password(password)
@@ -45,6 +67,8 @@ def signup():
 
         logging.debug("User created successfully")
         return jsonify({"message": "User created successfully"}), 201
+    except HasherBusy:
+        return jsonify({"error": "Server is busy, try again"}), 503, {'Retry-After': '1'}
     except IntegrityError as e:
         db.session.rollback()
         logging.error(f"IntegrityError: {str(e)}")
@@ -54,17 +78,33 @@ def signup():
 @cross_origin(origins=["http://localhost:3000"], supports_credentials=True)
 def login():
     data = request.get_json()
-    logging.debug(f"Received login data: {data}")
     username = data.get('username')
     password = data.get('password')
     user = User.query.filter_by(username=username).first()
     if user is None:
         logging.error('User not found')
         return jsonify({"error": "Invalid username or password"}), 401
-    if not user.check_password(password):
-        logging.error('Incorrect password')
-        return jsonify({"error": "Invalid username or password"}), 401
+    # Detach the loaded row and end the read transaction before the KDF, so logins waiting
+    # on the hasher do not hold pooled connections that every other request needs
+    db.session.expunge(user)
+    db.session.rollback()
+    try:
+        if not user.check_password(password):
+            logging.error('Incorrect password')
+            return jsonify({"error": "Invalid username or password"}), 401
+    except HasherBusy:
+        return jsonify({"error": "Server is busy, try again"}), 503, {'Retry-After': '1'}
+    try:
+        if user.password_needs_rehash():
+            # Upgrade hashes made with old KDF parameters while we have the plaintext
+            user.set_password(password)
+            db.session.merge(user)
+            db.session.commit()
+    except HasherBusy:
+        # The password already checked out; the upgrade can wait for a quieter login
+        logging.warning('Skipping password rehash, hasher is busy')
     login_user(user)
+    user_cache.put(CachedUser.from_model(user))
     logging.info('Login successful')
     return jsonify({"message": "Login successful"}), 200
 
@@ -75,64 +115,378 @@ def logout():
     return redirect(url_for('main.index'))
 
 @main.route('/api/contacts', methods=['GET'])
+@read_only
 @login_required
 @cross_origin(origins=["http://localhost:3000"], supports_credentials=True)
 def get_contacts():
-    users = User.query.filter(User.id != current_user.id).all()
-    contacts = [{'id': user.id, 'name': user.username, 'status': 'online'} for user in users]
-    return jsonify({'contacts': contacts})
+    try:
+        limit = parse_limit(request.args.get('limit'), current_app.config['CONTACTS_PAGE_SIZE'], current_app.config['CONTACTS_PAGE_MAX'])
+        after = int(request.args['after']) if 'after' in request.args else None
+    except ValueError:
+        return jsonify({'error': 'Invalid limit or cursor'}), 400
+
+    # Keyset over the (user_id, contact_id) unique index; names come from the user cache
+    query = db.session.query(Contact.contact_id).filter(Contact.user_id == current_user.id)
+    if after is not None:
+        query = query.filter(Contact.contact_id > after)
+    contact_ids = [contact_id for contact_id, in query.order_by(Contact.contact_id.asc()).limit(limit + 1)]
+
+    next_cursor = contact_ids[limit - 1] if len(contact_ids) > limit else None
+    contact_ids = contact_ids[:limit]
+    users = user_cache.load_many(contact_ids)
+    contacts = [{'id': contact_id, 'name': users[contact_id].username, 'status': presence.status(contact_id)} for contact_id in contact_ids if contact_id in users]
+    # Presence makes this list volatile, so the validator is a hash of the body itself
+    response = jsonify({'contacts': contacts, 'next_cursor': next_cursor})
+    response.add_etag(weak=True)
+    return response.make_conditional(request)
+
+@main.route('/api/contacts', methods=['POST'])
+@login_required
+@cross_origin(origins=["http://localhost:3000"], supports_credentials=True)
+def add_contact():
+    data = request.get_json(silent=True)
+    contact_id = data.get('contact_id') if isinstance(data, dict) else None
+    if contact_id is None:
+        return jsonify({'error': 'Contact ID is required'}), 400
+    try:
+        contact_id = int(contact_id)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Contact ID must be an integer'}), 400
+    if contact_id == current_user.id or user_cache.load(contact_id) is None:
+        return jsonify({'error': 'User not found'}), 404
+    try:
+        db.session.add(Contact(user_id=current_user.id, contact_id=contact_id))
+        db.session.commit()
+    except IntegrityError:
+        # Already a contact; adding is idempotent
+        db.session.rollback()
+    return jsonify({'id': contact_id, 'status': presence.status(contact_id)}), 201
 
 @main.route('/api/messages/<int:contact_id>', methods=['GET'])
+@read_only
 @login_required
 @cross_origin(origins=["http://localhost:3000"], supports_credentials=True)
 def get_messages(contact_id):
-    messages = Message.query.filter(
-        ((Message.sender_id == current_user.id) & (Message.recipient_id == contact_id)) |
-        ((Message.sender_id == contact_id) & (Message.recipient_id == current_user.id))
-    ).order_by(Message.timestamp.asc()).all()
-    return jsonify({'messages': [{'id': msg.id, 'content': msg.content, 'sender_id': msg.sender_id, 'timestamp': msg.timestamp} for msg in messages]})
+    try:
+        limit = parse_limit(request.args.get('limit'), current_app.config['MESSAGES_PAGE_SIZE'], current_app.config['MESSAGES_PAGE_MAX'])
+        before = decode_cursor(request.args['before']) if 'before' in request.args else None
+        after = decode_cursor(request.args['after']) if 'after' in request.args else None
+    except ValueError:
+        return jsonify({'error': 'Invalid limit or cursor'}), 400
+    if before and after:
+        return jsonify({'error': 'Use either before or after, not both'}), 400
+
+    # The thread only changes when a message is added, so the inbox row's message count is a
+    # version stamp (unlike its last message id, it also moves when an older send commits late):
+    # an unchanged page is answered with 304 before touching message rows. The conversation's
+    # archive extent rides along in the same statement so pages also change when older months
+    # are archived or expired
+    conversation_key = make_conversation_key(current_user.id, contact_id)
+    message_count = select(Conversation.message_count).filter_by(user_id=current_user.id, peer_id=contact_id).scalar_subquery()
+    version, archived_from, archived_until = db.session.execute(select(message_count, *message_archive.extent(conversation_key))).one()
+    etag = version_etag('messages', current_user.id, contact_id, version, archived_from, archived_until, request.query_string.decode())
+    if is_fresh(etag):
+        return not_modified(etag)
+
+    # Keyset pagination over (timestamp, id) inside a single conversation index range;
+    # only the index columns are read here, message bodies come from the fragment cache
+    query = db.session.query(Message.id, Message.timestamp).filter(Message.conversation_key == conversation_key)
+    position = tuple_(Message.timestamp, Message.id)
+    if after:
+        query = query.filter(position > tuple_(*after)).order_by(Message.timestamp.asc(), Message.id.asc())
+    else:
+        if before:
+            query = query.filter(position < tuple_(*before))
+        query = query.order_by(Message.timestamp.desc(), Message.id.desc())
+    page = query.limit(limit + 1).all()
+    # Months past the hot window live in the archive tiers; only consulted when the page reaches back that far
+    page, archived = message_archive.extend_page(page, conversation_key, before, after, limit, archived_until)
+
+    has_more = len(page) > limit
+    page = page[:limit]
+    if not after:
+        page.reverse()
+    next_cursor = None
+    if has_more:
+        edge = page[-1] if after else page[0]
+        next_cursor = encode_cursor(edge.timestamp, edge.id)
+    fragments = message_fragments.get_many([row.id for row in page], lambda ids: _load_message_records(ids, archived))
+    body = b'{"messages":[' + b','.join(fragments) + b'],"next_cursor":' + current_app.json.dumps(next_cursor).encode() + b'}'
+    return json_bytes_response(body, etag)
+
+def _load_message_records(message_ids, archived=None):
+    records = {message_id: archived[message_id] for message_id in message_ids if archived and message_id in archived}
+    hot_ids = [message_id for message_id in message_ids if message_id not in records]
+    if hot_ids:
+        rows = db.session.query(Message.id, Message.content, Message.sender_id, Message.timestamp).filter(Message.id.in_(hot_ids))
+        records.update({row.id: {'id': row.id, 'content': row.content, 'sender_id': row.sender_id, 'timestamp': row.timestamp} for row in rows})
+    return records
+
+@main.route('/api/messages/export', methods=['GET'])
+@read_only
+@login_required
+@cross_origin(origins=["http://localhost:3000"], supports_credentials=True)
+def export_messages():
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in ('ndjson', 'csv'):
+        return jsonify({'error': 'Format must be ndjson or csv'}), 400
+    try:
+        contact_id = int(request.args['contact_id']) if 'contact_id' in request.args else None
+        since = datetime.fromisoformat(request.args['since']) if 'since' in request.args else None
+        until = datetime.fromisoformat(request.args['until']) if 'until' in request.args else None
+    except ValueError:
+        return jsonify({'error': 'Invalid contact_id, since or until'}), 400
+    compress = request.args.get('gzip') in ('1', 'true')
+
+    # Plain column tuples streamed through a server-side cursor, never a full result list
+    conversation_key = make_conversation_key(current_user.id, contact_id) if contact_id is not None else None
+    query = select(Message.id, Message.sender_id, Message.recipient_id, Message.timestamp, Message.content)
+    if conversation_key is not None:
+        query = query.where(Message.conversation_key == conversation_key)
+    else:
+        query = query.where(or_(Message.sender_id == current_user.id, Message.recipient_id == current_user.id))
+    if since:
+        query = query.where(Message.timestamp >= since)
+    if until:
+        query = query.where(Message.timestamp < until)
+    query = query.order_by(Message.timestamp.asc(), Message.id.asc())
+    rows = db.session.execute(query.execution_options(yield_per=current_app.config['EXPORT_BATCH_SIZE']))
+
+    # Archived months come first, then the hot table, so the stream stays in time order
+    archived = message_archive.export_rows(current_user.id, conversation_key, since, until)
+    chunks = export_chunks(chain(archived, (tuple(row) for row in rows)), fmt)
+    filename = f'messages.{fmt}'
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    if compress:
+        chunks = gzip_chunks(chunks)
+        filename += '.gz'
+        mimetype = 'application/gzip'
+    return Response(stream_with_context(chunks), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
 
 @main.route('/api/messages', methods=['POST'])
 @login_required
 @cross_origin(origins=["http://localhost:3000"], supports_credentials=True)
 def send_message():
-    data = request.get_json()
-    recipient_id = data.get('recipient_id')
-    if recipient_id is None:
-        return jsonify({'error': 'Recipient ID is required'}), 400
-    message = Message(content=data['content'], sender_id=current_user.id, recipient_id=recipient_id)
-    db.session.add(message)
+    try:
+        payload, duplicate = _deliver_message(request.get_json(silent=True))
+    except InvalidMessage as e:
+        return jsonify({'error': str(e)}), 400
+    except (WriterBusy, FutureTimeoutError):
+        return jsonify({'error': 'Server is busy, try again'}), 503, {'Retry-After': '1'}
+    return jsonify(payload)
+
+def _deliver_message(data):
+    # Shared by POST /api/messages and the 'send_message' socket event
+    row = build_message_row(current_user.id, data)
+    if message_writer.enabled:
+        payload, duplicate = message_writer.write(row)
+    else:
+        payload, duplicate = store_messages([row])[0]
+    # The batched writer commits on its own thread, outside this request's session
+    pin_to_primary()
+    if not duplicate:
+        # Deliver only to the two participants' rooms instead of every connected client
+        socketio.emit('message', payload, to=[user_room(row['sender_id']), user_room(row['recipient_id'])])
+        metrics.socketio_emits.inc(event='message')
+    return payload, duplicate
+
+@main.route('/api/conversations', methods=['GET'])
+@read_only
+@login_required
+@cross_origin(origins=["http://localhost:3000"], supports_credentials=True)
+def get_conversations():
+    try:
+        limit = parse_limit(request.args.get('limit'), current_app.config['MESSAGES_PAGE_SIZE'], current_app.config['MESSAGES_PAGE_MAX'])
+        before = decode_cursor(request.args['before']) if 'before' in request.args else None
+    except ValueError:
+        return jsonify({'error': 'Invalid limit or cursor'}), 400
+
+    query = db.session.query(Conversation, User.username).join(User, User.id == Conversation.peer_id).filter(Conversation.user_id == current_user.id)
+    if before:
+        query = query.filter(tuple_(Conversation.last_message_at, Conversation.id) < tuple_(*before))
+    rows = query.order_by(Conversation.last_message_at.desc(), Conversation.id.desc()).limit(limit + 1).all()
+
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    next_cursor = None
+    if has_more:
+        edge = rows[-1][0]
+        next_cursor = encode_cursor(edge.last_message_at, edge.id)
+    conversations = [{
+        'contact_id': conversation.peer_id,
+        'name': username,
+        'last_message': {
+            'id': conversation.last_message_id,
+            'content': conversation.last_message_snippet,
+            'sender_id': conversation.last_sender_id,
+            'timestamp': conversation.last_message_at,
+        },
+        'unread_count': conversation.unread_count,
+        'last_read_message_id': conversation.last_read_message_id,
+    } for conversation, username in rows]
+    return jsonify({'conversations': conversations, 'next_cursor': next_cursor})
+
+@main.route('/api/conversations/<int:contact_id>/read', methods=['POST'])
+@login_required
+@cross_origin(origins=["http://localhost:3000"], supports_credentials=True)
+def mark_conversation_read(contact_id):
+    conversation = Conversation.query.filter_by(user_id=current_user.id, peer_id=contact_id).first()
+    if conversation is None:
+        return jsonify({'error': 'Conversation not found'}), 404
+    data = request.get_json(silent=True) or {}
+    try:
+        message_id = int(data.get('message_id') or conversation.last_message_id)
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Invalid message ID'}), 400
+    Conversation.mark_read(current_user.id, contact_id, min(message_id, conversation.last_message_id))
     db.session.commit()
-    socketio.emit('message', {'id': message.id, 'content': message.content, 'sender_id': message.sender_id, 'recipient_id': recipient_id, 'timestamp': message.timestamp}, broadcast=True)
-    return jsonify({'id': message.id, 'content': message.content, 'sender_id': message.sender_id, 'recipient_id': recipient_id, 'timestamp': message.timestamp})
+    db.session.refresh(conversation)
+    return jsonify({'contact_id': contact_id, 'unread_count': conversation.unread_count, 'last_read_message_id': conversation.last_read_message_id})
+
+@main.route('/api/search', methods=['GET'])
+@read_only
+@login_required
+@cross_origin(origins=["http://localhost:3000"], supports_credentials=True)
+def search_messages():
+    terms = (request.args.get('q') or '').strip()
+    if not terms:
+        return jsonify({'error': 'Search term is required'}), 400
+    try:
+        limit = parse_limit(request.args.get('limit'), current_app.config['SEARCH_PAGE_SIZE'], current_app.config['SEARCH_PAGE_MAX'])
+        offset = int(request.args.get('offset', 0))
+        if offset < 0:
+            raise ValueError('offset must not be negative')
+    except ValueError:
+        return jsonify({'error': 'Invalid limit or offset'}), 400
+
+    # Fetch one extra hit to know whether there is another page
+    hits = search_index.search(current_user.id, terms, limit + 1, offset)
+    next_offset = offset + limit if len(hits) > limit else None
+    results = [{
+        'id': msg.id,
+        'content': msg.content,
+        'sender_id': msg.sender_id,
+        'recipient_id': msg.recipient_id,
+        'timestamp': msg.timestamp,
+        'snippet': snippet,
+        'rank': rank,
+    } for msg, rank, snippet in hits[:limit]]
+    # Only the hot message table is indexed; clients are told where archived history begins
+    searchable_since = message_archive.archived_until()
+    if request.accept_mimetypes.best == 'text/html':
+        return render_template('serach_result.html', search_term=terms, results=results, next_offset=next_offset,
+                               searchable_since=searchable_since)
+    return jsonify({'results': results, 'next_offset': next_offset, 'searchable_since': searchable_since})
+
+@main.route('/api/sync', methods=['GET'])
+@read_only
+@login_required
+@cross_origin(origins=["http://localhost:3000"], supports_credentials=True)
+def sync():
+    try:
+        since = int(request.args.get('since', 0))
+        limit = parse_limit(request.args.get('limit'), current_app.config['SYNC_BATCH_SIZE'], current_app.config['SYNC_BATCH_MAX'])
+    except ValueError:
+        return jsonify({'error': 'Invalid since or limit'}), 400
+    return jsonify(changes_since(current_user.id, since, limit))
 
 @main.route('/api/messages/<int:message_id>/like', methods=['POST'])
 @login_required
 @cross_origin(origins=["http://localhost:3000"], supports_credentials=True)
 def like_message(message_id):
-    message = Message.query.get(message_id)
-    if message:
-        message.likes = message.likes + 1 if hasattr(message, 'likes') else 1
-        db.session.commit()
-        return jsonify({'id': message.id, 'content': message.content, 'sender_id': message.sender_id, 'likes': message.likes})
-    return jsonify({'error': 'Message not found'}), 404
+    message = db.session.get(Message, message_id)
+    if message is None or current_user.id not in (message.sender_id, message.recipient_id):
+        return jsonify({'error': 'Message not found'}), 404
+    try:
+        # One like per user per message; a repeat like is a no-op
+        with db.session.begin_nested():
+            db.session.add(MessageLike(message_id=message_id, user_id=current_user.id))
+        liked = True
+    except IntegrityError:
+        liked = False
+    if liked and not like_aggregator.enabled:
+        increment_likes(message_id)
+    db.session.commit()
+    if liked and like_aggregator.enabled:
+        like_aggregator.add(message_id)
+    likes = message.likes + like_aggregator.pending(message_id)
+    return jsonify({'id': message.id, 'content': message.content, 'sender_id': message.sender_id, 'likes': likes})
 
 @main.route('/api/profile', methods=['GET', 'PUT'])
+@read_only
 @login_required
 @cross_origin(origins=["http://localhost:3000"], supports_credentials=True)
 def profile():
     if request.method == 'GET':
-        user = User.query.get(current_user.id)
-        return jsonify({'profile': {'username': user.username, 'email': user.email}})
+        # current_user is already the cached record loaded by flask_login
+        etag = version_etag('profile', current_user.id, current_user.username, current_user.email)
+        if is_fresh(etag):
+            return not_modified(etag)
+        response = jsonify({'profile': {'username': current_user.username, 'email': current_user.email}})
+        response.set_etag(etag, weak=True)
+        return response
     if request.method == 'PUT':
         data = request.get_json()
         user = User.query.get(current_user.id)
         user.username = data['username']
         user.email = data['email']
         db.session.commit()
+        user_cache.invalidate(user.id)
         return jsonify({'success': True})
 
+@socketio.on('connect')
+def handle_connect(auth=None):
+    # Private delivery needs to know who is on the socket, so anonymous connections are refused
+    if not current_user.is_authenticated:
+        return False
+    join_room(user_room(current_user.id))
+    presence.connect(current_user.id, request.sid)
+    metrics.socketio_connects.inc()
+    metrics.socketio_connections.inc()
+    # Reconnecting clients can pass {"since": <cursor>} to get missed messages in the handshake
+    if isinstance(auth, dict) and auth.get('since') is not None:
+        try:
+            since = int(auth['since'])
+        except (TypeError, ValueError):
+            return
+        emit('sync', changes_since(current_user.id, since, current_app.config['SYNC_BATCH_SIZE']))
+        metrics.socketio_emits.inc(event='sync')
+
+@socketio.on('disconnect')
+def handle_disconnect(reason=None):
+    presence.disconnect(request.sid)
+    metrics.socketio_connections.dec()
+
+@socketio.on('sync')
+def handle_sync(data=None):
+    # Same delta as GET /api/sync, returned as the event's ack
+    data = data if isinstance(data, dict) else {}
+    try:
+        since = int(data.get('since', 0))
+        limit = parse_limit(data.get('limit'), current_app.config['SYNC_BATCH_SIZE'], current_app.config['SYNC_BATCH_MAX'])
+    except (TypeError, ValueError):
+        return {'error': 'Invalid since or limit'}
+    return changes_since(current_user.id, since, limit)
+
+@socketio.on('send_message')
+def handle_send_message(data):
+    # The return value is the ack; clients retry with the same client_msg_id until they get one
+    try:
+        payload, duplicate = _deliver_message(data)
+    except InvalidMessage as e:
+        return {'ok': False, 'error': str(e)}
+    except (WriterBusy, FutureTimeoutError):
+        return {'ok': False, 'error': 'Server is busy, try again', 'retry': True}
+    return {'ok': True, 'duplicate': duplicate, 'message': payload}
+
+@socketio.on('heartbeat')
+def handle_heartbeat(data=None):
+    presence.heartbeat(request.sid)
+
 @socketio.on('message')
 def handle_message(data):
     logging.debug(f"Received message from client: {data}")
-    socketio.send(data)
+    # Legacy echo, back to the sender's own sockets only: 'message' events now carry private
+    # deliveries, so a broadcast would let any client push fake messages to everyone
+    socketio.send(data, to=user_room(current_user.id))
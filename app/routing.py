@@ -0,0 +1,92 @@
+import time
+from functools import wraps
+from flask import g, has_request_context, request, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+
+REPLICA_BIND = 'replica'
+_STICKY_KEY = '_db_primary_until'
+# Per-user pins for writes the cookie cannot carry: Socket.IO handlers get a copy of the
+# session that never reaches the browser. Only covers reads served by this process.
+_primary_until = {}
+_next_prune = 0
+
+
+def read_only(view):
+    # Marks a view's GET/HEAD requests as safe to serve from the read replica
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if request.method in ('GET', 'HEAD'):
+            g.db_read_only = True
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def _session_user_id():
+    # Read flask_login's id straight from the session; current_user could load the user
+    # through this very session while a bind is being chosen
+    user_id = session.get('_user_id')
+    return int(user_id) if user_id is not None else None
+
+
+def pin_to_primary():
+    # Call after a write commits: the writer's reads skip the replica for REPLICA_STICKY_SECONDS,
+    # wherever the write committed (request session, writer thread, socket event)
+    from flask import current_app
+
+    if not has_request_context():
+        return
+    global _next_prune
+    now = time.time()
+    until = now + current_app.config.get('REPLICA_STICKY_SECONDS', 5.0)
+    session[_STICKY_KEY] = until
+    user_id = _session_user_id()
+    if user_id is not None:
+        _primary_until[user_id] = until
+    if now >= _next_prune:
+        # Expired pins are dropped once per sticky window
+        _next_prune = until
+        for key, deadline in list(_primary_until.items()):
+            if deadline < now:
+                _primary_until.pop(key, None)
+
+
+class RoutingSession(Session):
+    # Sends reads in read-only requests to the replica, everything else to the primary.
+    # A session that has written, or a user who wrote within REPLICA_STICKY_SECONDS,
+    # stays on the primary so they always read their own writes.
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self._use_replica():
+            replica = self._db.engines.get(REPLICA_BIND)
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def _use_replica(self):
+        if self._flushing or self.info.get('wrote') or not has_request_context():
+            return False
+        if not g.get('db_read_only'):
+            return False
+        now = time.time()
+        if session.get(_STICKY_KEY, 0) >= now:
+            return False
+        return _primary_until.get(_session_user_id(), 0) < now
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _after_flush(db_session, flush_context):
+    db_session.info['wrote'] = True
+
+
+@event.listens_for(RoutingSession, 'do_orm_execute')
+def _on_execute(orm_execute_state):
+    # Bulk/core-style UPDATE, INSERT and DELETE statements bypass flush
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        orm_execute_state.session.info['wrote'] = True
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _after_commit(db_session):
+    if db_session.info.pop('wrote', False):
+        pin_to_primary()
@@ -0,0 +1,166 @@
+import weakref
+from sqlalchemy import column, func, or_, select, text
+from . import db
+
+# Plain-text highlight markers, so snippets are safe to show without HTML escaping rules
+MARK_START = '**'
+MARK_END = '**'
+
+
+class PostgresSearch:
+    # Backed by the GIN index on to_tsvector(<config>, content); PostgreSQL keeps it current
+    def __init__(self, ts_config):
+        self.ts_config = ts_config
+
+    def add(self, messages):
+        pass
+
+    def remove(self, messages):
+        pass
+
+    def rebuild(self):
+        return 0
+
+    def search(self, user_id, terms, limit, offset):
+        from .models.message import Message
+
+        query = func.plainto_tsquery(self.ts_config, terms)
+        vector = func.to_tsvector(self.ts_config, Message.content)
+        rank = func.ts_rank(vector, query).label('rank')
+        snippet = func.ts_headline(
+            self.ts_config, Message.content, query,
+            f'StartSel={MARK_START}, StopSel={MARK_END}, MaxWords=20, MinWords=5',
+        ).label('snippet')
+        return (
+            db.session.query(Message, rank, snippet)
+            .filter(vector.op('@@')(query))
+            .filter(or_(Message.sender_id == user_id, Message.recipient_id == user_id))
+            .order_by(rank.desc(), Message.id.desc())
+            .limit(limit)
+            .offset(offset)
+            .all()
+        )
+
+
+class SqliteSearch:
+    # FTS5 table over message.content (external content, rowid = message.id), updated on send
+    def __init__(self):
+        self._ready = False
+
+    def _has_table(self):
+        if not self._ready:
+            self._ready = db.session.execute(text(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'message_fts'"
+            )).first() is not None
+        return self._ready
+
+    def _ensure_table(self):
+        # Databases made with create_all() instead of migrations lack the virtual table. Only
+        # writes create it: a search may be a read-only request served from the replica
+        if not self._has_table():
+            self.rebuild()
+            self._ready = True
+
+    def add(self, messages):
+        self._ensure_table()
+        db.session.execute(
+            text('INSERT INTO message_fts (rowid, content) VALUES (:id, :content)'),
+            [{'id': message.id, 'content': message.content} for message in messages],
+        )
+
+    def remove(self, messages):
+        self._ensure_table()
+        db.session.execute(
+            text("INSERT INTO message_fts (message_fts, rowid, content) VALUES ('delete', :id, :content)"),
+            [{'id': message.id, 'content': message.content} for message in messages],
+        )
+
+    def rebuild(self):
+        db.session.execute(text(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS message_fts USING fts5(content, content='message', content_rowid='id')"
+        ))
+        db.session.execute(text("INSERT INTO message_fts (message_fts) VALUES ('rebuild')"))
+        return db.session.execute(text('SELECT COUNT(*) FROM message')).scalar()
+
+    def search(self, user_id, terms, limit, offset):
+        from .models.message import Message
+
+        if not self._has_table():
+            return LikeSearch().search(user_id, terms, limit, offset)
+        # Quote every word so user input is never parsed as FTS5 query syntax
+        match = ' '.join('"{}"'.format(word.replace('"', '""')) for word in terms.split())
+        statement = text(
+            'SELECT message.*, bm25(message_fts) AS rank, '
+            'snippet(message_fts, 0, :start, :end, \'…\', 12) AS snippet '
+            'FROM message_fts JOIN message ON message.id = message_fts.rowid '
+            'WHERE message_fts MATCH :match AND (message.sender_id = :user_id OR message.recipient_id = :user_id) '
+            'ORDER BY rank, message.id DESC LIMIT :limit OFFSET :offset'
+        ).bindparams(match=match, user_id=user_id, limit=limit, offset=offset, start=MARK_START, end=MARK_END)
+        rows = db.session.execute(
+            select(Message, column('rank'), column('snippet')).from_statement(statement)
+        ).all()
+        # bm25 is "lower is better"; flip it so both backends rank descending
+        return [(message, -rank, snippet) for message, rank, snippet in rows]
+
+
+class LikeSearch:
+    # Fallback for databases without a full-text backend here: unindexed LIKE matching, newest first
+    def add(self, messages):
+        pass
+
+    def remove(self, messages):
+        pass
+
+    def rebuild(self):
+        return 0
+
+    def search(self, user_id, terms, limit, offset):
+        from .models.message import Message
+
+        query = db.session.query(Message).filter(or_(Message.sender_id == user_id, Message.recipient_id == user_id))
+        for word in terms.split():
+            escaped = word.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            query = query.filter(Message.content.ilike(f'%{escaped}%', escape='\\'))
+        messages = query.order_by(Message.id.desc()).limit(limit).offset(offset).all()
+        return [(message, 0.0, message.content) for message in messages]
+
+
+class SearchIndex:
+    # Picks the backend from the dialect of the engine the session would query on first use;
+    # backends are kept per engine (primary or replica) because SqliteSearch remembers whether
+    # that database has its FTS table
+
+    def __init__(self):
+        self.ts_config = 'english'
+        self._backends = weakref.WeakKeyDictionary()
+
+    def init_app(self, app):
+        self.ts_config = app.config.get('SEARCH_TS_CONFIG', self.ts_config)
+
+    @property
+    def backend(self):
+        engine = db.session.get_bind()
+        if engine not in self._backends:
+            dialect = engine.dialect.name
+            if dialect == 'postgresql':
+                self._backends[engine] = PostgresSearch(self.ts_config)
+            elif dialect == 'sqlite':
+                self._backends[engine] = SqliteSearch()
+            else:
+                self._backends[engine] = LikeSearch()
+        return self._backends[engine]
+
+    def add(self, messages):
+        self.backend.add(messages)
+
+    def remove(self, messages):
+        self.backend.remove(messages)
+
+    def rebuild(self):
+        return self.backend.rebuild()
+
+    def search(self, user_id, terms, limit, offset=0):
+        return self.backend.search(user_id, terms, limit, offset)
+
+
+search_index = SearchIndex()
@@ -0,0 +1,91 @@
+import threading
+from collections import OrderedDict
+from datetime import date
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.http import http_date
+
+try:
+    import orjson
+except ImportError:  # optional speedup
+    orjson = None
+
+
+def _orjson_default(o):
+    # Match Flask's default provider so switching providers does not change the payloads
+    if isinstance(o, date):
+        return http_date(o)
+    return DefaultJSONProvider.default(o)
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    def dumps(self, obj, **kwargs):
+        # response() (jsonify) always passes separators= for compact output or indent= in debug;
+        # orjson is compact by default and only indents by two, so both map onto its options
+        indent = kwargs.pop('indent', None)
+        separators = kwargs.pop('separators', None)
+        if kwargs:
+            return super().dumps(obj, indent=indent, separators=separators, **kwargs)
+        option = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        return orjson.dumps(obj, default=_orjson_default, option=option).decode()
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+
+def init_app(app):
+    provider = app.config.get('JSON_PROVIDER', 'default')
+    if provider == 'orjson':
+        if orjson is None:
+            app.logger.warning('JSON_PROVIDER is orjson but orjson is not installed; using the default provider')
+        else:
+            app.json = OrjsonProvider(app)
+    message_fragments.maxsize = app.config.get('MESSAGE_FRAGMENT_CACHE_SIZE', message_fragments.maxsize)
+
+
+class FragmentCache:
+    # Serialized JSON objects for messages, keyed by id. The fields cached here never
+    # change after a message is written, so entries only leave by LRU eviction.
+
+    def __init__(self, maxsize=50000):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(self, message_ids, load):
+        # load(missing_ids) must return {id: dict}; results come back in message_ids order
+        from flask import current_app
+
+        found = {}
+        with self._lock:
+            for message_id in message_ids:
+                fragment = self._entries.get(message_id)
+                if fragment is not None:
+                    self._entries.move_to_end(message_id)
+                    found[message_id] = fragment
+        missing = [message_id for message_id in message_ids if message_id not in found]
+        if missing:
+            fresh = {message_id: current_app.json.dumps(record).encode() for message_id, record in load(missing).items()}
+            with self._lock:
+                self._entries.update(fresh)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+            found.update(fresh)
+        return [found[message_id] for message_id in message_ids if message_id in found]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def discard(self, message_ids):
+        with self._lock:
+            for message_id in message_ids:
+                self._entries.pop(message_id, None)
+
+
+message_fragments = FragmentCache()
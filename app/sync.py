@@ -0,0 +1,58 @@
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import select, union_all
+from . import db
+from .models.message import Message
+
+
+def changes_since(user_id, since, limit):
+    # Two index range scans (sender_id, id) and (recipient_id, id) merged by id,
+    # instead of one history query per contact
+    sent = (
+        select(Message.id)
+        .where(Message.sender_id == user_id, Message.id > since)
+        .order_by(Message.id)
+        .limit(limit + 1)
+        .subquery()
+    )
+    received = (
+        select(Message.id)
+        .where(Message.recipient_id == user_id, Message.sender_id != user_id, Message.id > since)
+        .order_by(Message.id)
+        .limit(limit + 1)
+        .subquery()
+    )
+    ids = union_all(select(sent.c.id), select(received.c.id)).subquery()
+    messages = (
+        db.session.query(Message)
+        .filter(Message.id.in_(select(ids.c.id)))
+        .order_by(Message.id)
+        .limit(limit + 1)
+        .all()
+    )
+    has_more = len(messages) > limit
+    messages = messages[:limit]
+
+    # Ids are allocated at insert but become visible at commit, so a lower id can show up after
+    # a higher one was served. The cursor stops before the first message younger than
+    # SYNC_SETTLE_SECONDS; those are sent again next time (clients dedupe by id) instead of
+    # letting a late commit below the cursor be skipped for good
+    settled_before = datetime.utcnow() - timedelta(seconds=current_app.config.get('SYNC_SETTLE_SECONDS', 10))
+    cursor = since
+    for msg in messages:
+        if msg.timestamp > settled_before:
+            # Ending the batch here keeps clients from re-polling the same unsettled rows
+            has_more = False
+            break
+        cursor = msg.id
+    return {
+        'messages': [{
+            'id': msg.id,
+            'content': msg.content,
+            'sender_id': msg.sender_id,
+            'recipient_id': msg.recipient_id,
+            'timestamp': msg.timestamp,
+        } for msg in messages],
+        'cursor': cursor,
+        'has_more': has_more,
+    }
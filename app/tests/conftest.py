@@ -0,0 +1,66 @@
+import os
+import sys
+
+import pytest
+
+# app/pytest.ini makes app/ the rootdir; the package itself is imported from the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from app import create_app, db  # noqa: E402
+from app.cache import user_cache  # noqa: E402
+from app.models import User  # noqa: E402
+from app.serialization import message_fragments  # noqa: E402
+
+PASSWORD = 'password'
+
+
+@pytest.fixture
+def make_app(tmp_path):
+    # A fresh SQLite database per app; keyword arguments override config.Config
+    def make(name='app', **config):
+        settings = {
+            'SQLALCHEMY_DATABASE_URI': f'sqlite:///{tmp_path / name}.db',
+            'SQLALCHEMY_ENGINE_OPTIONS': {},
+            'SQLALCHEMY_BINDS': {},
+            'TESTING': True,
+            'DEBUG': False,
+            'PASSWORD_HASH_METHOD': 'pbkdf2:sha256:1000',
+            'LOG_LEVEL': 'WARNING',
+        }
+        settings.update(config)
+        app = create_app(settings)
+        with app.app_context():
+            db.create_all(bind_key=None)
+        user_cache.clear()
+        message_fragments.clear()
+        return app
+    return make
+
+
+@pytest.fixture
+def app(make_app):
+    return make_app()
+
+
+@pytest.fixture
+def add_user():
+    def add(app, username):
+        with app.app_context():
+            user = User(username=username, email=f'{username}@example.com')
+            user.set_password(PASSWORD)
+            db.session.add(user)
+            db.session.commit()
+            return user.id
+    return add
+
+
+@pytest.fixture
+def client_for():
+    # Test client already logged in as user_id, without paying for a password check
+    def client(app, user_id):
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['_user_id'] = str(user_id)
+            session['_fresh'] = True
+        return client
+    return client
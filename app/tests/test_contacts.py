@@ -0,0 +1,14 @@
+def test_add_contact_validates_id(app, add_user, client_for):
+    alice, bob = add_user(app, 'alice'), add_user(app, 'bob')
+    client = client_for(app, alice)
+
+    assert client.post('/api/contacts', json={}).status_code == 400
+    assert client.post('/api/contacts', json=['contact_id']).status_code == 400
+    assert client.post('/api/contacts', json={'contact_id': 'abc'}).status_code == 400
+    assert client.post('/api/contacts', json={'contact_id': str(alice)}).status_code == 404
+    assert client.post('/api/contacts', json={'contact_id': 9999}).status_code == 404
+
+    response = client.post('/api/contacts', json={'contact_id': str(bob)})
+    assert response.status_code == 201
+    assert response.json['id'] == bob
+    assert [contact['id'] for contact in client.get('/api/contacts').json['contacts']] == [bob]
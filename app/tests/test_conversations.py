@@ -0,0 +1,40 @@
+from datetime import datetime, timedelta
+
+from app import db
+from app.models import Conversation, Message
+
+
+def _message(sender_id, recipient_id, content, timestamp):
+    message = Message(sender_id=sender_id, recipient_id=recipient_id, content=content, timestamp=timestamp)
+    db.session.add(message)
+    db.session.flush()
+    return message
+
+
+def test_late_commit_of_older_message_keeps_newest_in_inbox(app, add_user):
+    alice, bob = add_user(app, 'alice'), add_user(app, 'bob')
+    with app.app_context():
+        now = datetime.utcnow()
+        older = _message(alice, bob, 'first', now)
+        newer = _message(alice, bob, 'second', now + timedelta(seconds=1))
+        # The higher id commits first, as when two sends race on the inbox row lock
+        Conversation.record_message(newer)
+        Conversation.record_message(older)
+        db.session.commit()
+
+        inbox = Conversation.query.filter_by(user_id=bob, peer_id=alice).one()
+        assert (inbox.last_message_id, inbox.last_message_snippet) == (newer.id, 'second')
+        assert inbox.last_message_at == newer.timestamp
+        assert inbox.unread_count == 2
+
+        outbox = Conversation.query.filter_by(user_id=alice, peer_id=bob).one()
+        assert (outbox.last_message_id, outbox.last_read_message_id, outbox.unread_count) == (newer.id, newer.id, 0)
+
+
+def test_inbox_follows_messages_in_order(app, add_user, client_for):
+    alice, bob = add_user(app, 'alice'), add_user(app, 'bob')
+    client = client_for(app, alice)
+    ids = [client.post('/api/messages', json={'recipient_id': bob, 'content': f'hi {n}'}).json['id'] for n in range(3)]
+    inbox = client_for(app, bob).get('/api/conversations').json['conversations'][0]
+    assert inbox['last_message']['id'] == ids[-1]
+    assert inbox['unread_count'] == 3
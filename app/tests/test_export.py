@@ -0,0 +1,57 @@
+import json
+import os
+
+import pytest
+from sqlalchemy import text
+
+from app import db
+from app.models.message import make_conversation_key
+
+MESSAGES = 1000000
+RSS_BUDGET = 64 * 1024 * 1024  # growth allowed while streaming, far below what 1M rows in memory need
+
+
+def _rss():
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def _seed(app, sender_id, recipient_id, count):
+    # Generated inside SQLite so seeding does not itself hold a million rows in Python
+    with app.app_context():
+        db.session.execute(text(
+            'WITH RECURSIVE n(i) AS (SELECT 0 UNION ALL SELECT i + 1 FROM n WHERE i + 1 < :count) '
+            'INSERT INTO message (sender_id, recipient_id, conversation_key, content, timestamp, likes) '
+            "SELECT :sender, :recipient, :key, 'exported message ' || i, "
+            "datetime('2020-01-01', '+' || i || ' seconds'), 0 FROM n"
+        ), {'count': count, 'sender': sender_id, 'recipient': recipient_id,
+            'key': make_conversation_key(sender_id, recipient_id)})
+        db.session.commit()
+
+
+@pytest.mark.skipif(not os.path.exists('/proc/self/statm'), reason='RSS is read from /proc')
+def test_export_streams_a_million_messages_in_constant_memory(app, add_user, client_for):
+    alice, bob = add_user(app, 'alice'), add_user(app, 'bob')
+    _seed(app, alice, bob, MESSAGES)
+    client = client_for(app, alice)
+
+    baseline = peak = _rss()
+    response = client.get(f'/api/messages/export?contact_id={bob}', buffered=False)
+    assert response.status_code == 200
+    lines = 0
+    pending = b''
+    first = last = None
+    for chunk in response.response:
+        pending += chunk
+        *complete, pending = pending.split(b'\n')
+        if complete:
+            first = first or json.loads(complete[0])
+            last = json.loads(complete[-1])
+        lines += len(complete)
+        peak = max(peak, _rss())
+    response.close()
+
+    assert pending == b''
+    assert lines == MESSAGES
+    assert (first['content'], last['content']) == ('exported message 0', f'exported message {MESSAGES - 1}')
+    assert peak - baseline < RSS_BUDGET
@@ -0,0 +1,42 @@
+import json
+from datetime import datetime, timedelta
+
+from app.commands import import_group
+
+
+def _write_messages(path, records):
+    path.write_text(''.join(json.dumps(record) + '\n' for record in records))
+    return str(path)
+
+
+def test_message_import_keeps_inbox_state(app, add_user, client_for, tmp_path):
+    alice, bob, carol = add_user(app, 'alice'), add_user(app, 'bob'), add_user(app, 'carol')
+    first_id = client_for(app, alice).post('/api/messages', json={'recipient_id': bob, 'content': 'are you there?'}).json['id']
+    client_for(app, bob).post('/api/messages', json={'recipient_id': carol, 'content': 'lunch?'})
+    client_for(app, alice).post('/api/messages', json={'recipient_id': bob, 'content': 'ping'})
+
+    path = _write_messages(tmp_path / 'history.ndjson', [
+        {'sender': 'alice', 'recipient': 'bob', 'content': 'old news', 'timestamp': '2020-01-01T00:00:00'},
+        {'sender': 'carol', 'recipient': 'alice', 'content': 'hello from the archive', 'timestamp': '2020-01-02T00:00:00'},
+        {'sender': 'carol', 'recipient': 'bob', 'content': 'sure', 'timestamp': (datetime.utcnow() + timedelta(hours=1)).isoformat()},
+    ])
+    result = app.test_cli_runner().invoke(import_group, ['messages', path])
+    assert result.exit_code == 0, result.output
+
+    inbox = {row['name']: row for row in client_for(app, bob).get('/api/conversations').json['conversations']}
+    # Unread badges from live traffic survive, and older imported history does not replace the latest message
+    assert inbox['alice']['unread_count'] == 2
+    assert inbox['alice']['last_message']['content'] == 'ping'
+    assert inbox['carol']['unread_count'] == 0
+    # An imported message that is newer than the live ones does become the latest
+    assert inbox['carol']['last_message']['content'] == 'sure'
+
+    carol_inbox = {row['name']: row for row in client_for(app, carol).get('/api/conversations').json['conversations']}
+    assert carol_inbox['bob']['unread_count'] == 1
+    # A conversation that only exists in the imported history starts out read
+    assert carol_inbox['alice']['unread_count'] == 0
+    assert carol_inbox['alice']['last_message']['content'] == 'hello from the archive'
+
+    # Recounting unread after a partial read skips the imported history despite its higher ids
+    read = client_for(app, bob).post(f'/api/conversations/{alice}/read', json={'message_id': first_id}).json
+    assert read['unread_count'] == 1
@@ -0,0 +1,67 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from sqlalchemy import func
+
+from app import db
+from app.likes import like_aggregator
+from app.models import Message, MessageLike
+
+MESSAGES = 200
+REPEATS = 3  # every participant likes every message this many times; only the first counts
+
+
+@pytest.mark.parametrize('aggregation', [False, True])
+def test_parallel_likes_are_not_lost(make_app, add_user, client_for, aggregation):
+    app = make_app(LIKE_AGGREGATION=aggregation, LIKE_FLUSH_INTERVAL=0.05)
+    alice, bob = add_user(app, 'alice'), add_user(app, 'bob')
+    sender = client_for(app, alice)
+    message_ids = [sender.post('/api/messages', json={'recipient_id': bob, 'content': f'm{n}'}).json['id'] for n in range(MESSAGES)]
+
+    clients = threading.local()
+
+    def like(job):
+        user_id, message_id = job
+        if not hasattr(clients, 'by_user'):
+            clients.by_user = {uid: client_for(app, uid) for uid in (alice, bob)}
+        return clients.by_user[user_id].post(f'/api/messages/{message_id}/like').status_code
+
+    jobs = [(user_id, message_id) for message_id in message_ids for user_id in (alice, bob)] * REPEATS
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        statuses = list(pool.map(like, jobs))
+    assert statuses == [200] * len(jobs)
+
+    with app.app_context():
+        if aggregation:
+            like_aggregator.flush()
+        recorded = dict(db.session.query(MessageLike.message_id, func.count()).group_by(MessageLike.message_id))
+        counted = dict(db.session.query(Message.id, Message.likes))
+    assert sum(recorded.values()) == 2 * MESSAGES
+    assert counted == recorded
+
+
+def test_reinitialising_flushes_the_old_app_and_restarts_the_thread(make_app, add_user, client_for):
+    def liked_message(app):
+        alice, bob = add_user(app, 'alice'), add_user(app, 'bob')
+        client = client_for(app, alice)
+        message_id = client.post('/api/messages', json={'recipient_id': bob, 'content': 'like me'}).json['id']
+        assert client.post(f'/api/messages/{message_id}/like').json['likes'] == 1
+        return message_id
+
+    def stored_likes(app, message_id):
+        with app.app_context():
+            return db.session.get(Message, message_id).likes
+
+    first = make_app('first', LIKE_AGGREGATION=True, LIKE_FLUSH_INTERVAL=60)
+    first_id = liked_message(first)
+    assert stored_likes(first, first_id) == 0
+
+    second = make_app('second', LIKE_AGGREGATION=True, LIKE_FLUSH_INTERVAL=0.01)
+    assert stored_likes(first, first_id) == 1
+    second_id = liked_message(second)
+    deadline = time.monotonic() + 5
+    while stored_likes(second, second_id) == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert stored_likes(second, second_id) == 1
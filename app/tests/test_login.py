@@ -0,0 +1,51 @@
+from app import db
+from app.hashing import HasherBusy, password_hasher
+from app.models import User
+
+
+def _login(app, username='alice', password='password'):
+    return app.test_client().post('/login', json={'username': username, 'password': password})
+
+
+def test_auto_pool_uses_threads_without_monkey_patching(make_app):
+    make_app(PASSWORD_HASH_POOL='auto', PASSWORD_HASH_WORKERS=2)
+    assert password_hasher.mode == 'thread'
+    make_app(PASSWORD_HASH_WORKERS=0)
+    assert password_hasher.mode == 'inline'
+
+
+def test_login_releases_its_connection_while_hashing(app, add_user, monkeypatch):
+    add_user(app, 'alice')
+    in_transaction = []
+    verify = password_hasher.verify
+
+    def checked_verify(pwhash, password):
+        in_transaction.append(db.session().in_transaction())
+        return verify(pwhash, password)
+
+    monkeypatch.setattr(password_hasher, 'verify', checked_verify)
+    assert _login(app).status_code == 200
+    assert in_transaction == [False]
+
+
+def test_busy_hasher_skips_the_rehash_but_logs_in(make_app, add_user, monkeypatch):
+    # Stored with an older cost than the app now uses, so a successful login wants to rehash
+    app = make_app(PASSWORD_HASH_METHOD='pbkdf2:sha256:1000')
+    add_user(app, 'alice')
+    app = make_app(PASSWORD_HASH_METHOD='pbkdf2:sha256:2000')
+    with app.app_context():
+        old_hash = User.query.filter_by(username='alice').one().password_hash
+
+    def busy(password):
+        raise HasherBusy('Too many password hashes in flight')
+
+    monkeypatch.setattr(password_hasher, '_prefix', 'pbkdf2:sha256:2000')
+    monkeypatch.setattr(password_hasher, 'hash', busy)
+    assert _login(app).status_code == 200
+    with app.app_context():
+        assert User.query.filter_by(username='alice').one().password_hash == old_hash
+
+    monkeypatch.undo()
+    assert _login(app).status_code == 200
+    with app.app_context():
+        assert User.query.filter_by(username='alice').one().password_hash.startswith('pbkdf2:sha256:2000$')
@@ -0,0 +1,78 @@
+from datetime import datetime, timedelta
+
+from sqlalchemy import event
+
+from app import db
+from app.models import Conversation, Message
+from app.pagination import encode_cursor
+
+
+def _page_query_plans(app, client, urls):
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if 'FROM message' in statement and 'message.conversation_key = ?' in statement:
+            statements.append((statement, parameters))
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', capture)
+    try:
+        for url in urls:
+            assert client.get(url).status_code == 200
+    finally:
+        event.remove(engine, 'before_cursor_execute', capture)
+
+    plans = []
+    with engine.connect() as conn:
+        for statement, parameters in statements:
+            rows = conn.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters).all()
+            plans.append(' | '.join(row[-1] for row in rows))
+    return plans
+
+
+def test_history_page_is_one_index_range_scan(app, add_user, client_for):
+    alice, bob, carol = add_user(app, 'alice'), add_user(app, 'bob'), add_user(app, 'carol')
+    client = client_for(app, alice)
+    sent = [client.post('/api/messages', json={'recipient_id': bob if n % 2 else carol, 'content': f'hi {n}'}).json for n in range(20)]
+    middle = sent[11]
+    with app.app_context():
+        cursor = encode_cursor(db.session.get(Message, middle['id']).timestamp, middle['id'])
+
+    plans = _page_query_plans(app, client, [
+        f'/api/messages/{bob}?limit=5',
+        f'/api/messages/{bob}?limit=5&before={cursor}',
+        f'/api/messages/{bob}?limit=5&after={cursor}',
+    ])
+    assert len(plans) == 3
+    for plan in plans:
+        # Bounded by the conversation key and cursor, already in page order: cost does not grow with the thread
+        assert 'ix_message_conversation_timestamp_id' in plan
+        assert 'TEMP B-TREE' not in plan
+
+
+
+def test_late_commit_of_older_send_changes_the_page_etag(app, add_user, client_for):
+    alice, bob = add_user(app, 'alice'), add_user(app, 'bob')
+    start = datetime.utcnow()
+
+    def commit_message(message_id, seconds):
+        with app.app_context():
+            message = Message(id=message_id, sender_id=alice, recipient_id=bob, content=f'm{message_id}',
+                              timestamp=start + timedelta(seconds=seconds))
+            db.session.add(message)
+            db.session.flush()
+            Conversation.record_message(message)
+            db.session.commit()
+
+    # Message 3 was assigned its id before message 4 but its transaction commits last
+    for message_id in (1, 2, 4):
+        commit_message(message_id, message_id)
+    client = client_for(app, bob)
+    first = client.get(f'/api/messages/{alice}')
+    assert [m['id'] for m in first.json['messages']] == [1, 2, 4]
+
+    commit_message(3, 3)
+    again = client.get(f'/api/messages/{alice}', headers={'If-None-Match': first.headers['ETag']})
+    assert again.status_code == 200
+    assert [m['id'] for m in again.json['messages']] == [1, 2, 3, 4]
@@ -0,0 +1,49 @@
+import shutil
+
+import pytest
+
+from app import db, socketio
+
+
+@pytest.fixture
+def replicated(make_app, add_user, tmp_path):
+    # Two SQLite files; the replica is a snapshot taken after the users exist and never
+    # receives later writes, i.e. a replica with unbounded lag
+    def make(**config):
+        replica_path = tmp_path / 'replica.db'
+        app = make_app(SQLALCHEMY_BINDS={'replica': f'sqlite:///{replica_path}'}, **config)
+        alice, bob = add_user(app, 'alice'), add_user(app, 'bob')
+        with app.app_context():
+            db.session.remove()
+            db.engines['replica'].dispose()
+            shutil.copyfile(tmp_path / 'app.db', replica_path)
+        return app, alice, bob
+    return make
+
+
+def _history(client, peer_id):
+    return [message['content'] for message in client.get(f'/api/messages/{peer_id}').json['messages']]
+
+
+@pytest.mark.parametrize('batching', [False, True])
+def test_http_send_reads_own_write(replicated, client_for, batching):
+    app, alice, bob = replicated(MESSAGE_WRITE_BATCHING=batching)
+    client = client_for(app, alice)
+    assert client.post('/api/messages', json={'recipient_id': bob, 'content': 'hello'}).status_code == 200
+    assert _history(client, bob) == ['hello']
+
+
+@pytest.mark.parametrize('batching', [False, True])
+def test_socket_send_reads_own_write(replicated, client_for, batching):
+    app, alice, bob = replicated(MESSAGE_WRITE_BATCHING=batching)
+    client = client_for(app, alice)
+    sock = socketio.test_client(app, flask_test_client=client)
+    assert sock.emit('send_message', {'recipient_id': bob, 'content': 'hello'}, callback=True)['ok']
+    assert _history(client, bob) == ['hello']
+
+
+def test_reads_use_replica_once_the_pin_expires(replicated, client_for):
+    app, alice, bob = replicated(REPLICA_STICKY_SECONDS=0)
+    client = client_for(app, alice)
+    assert client.post('/api/messages', json={'recipient_id': bob, 'content': 'hello'}).status_code == 200
+    assert _history(client, bob) == []
@@ -0,0 +1,77 @@
+import shutil
+import sqlite3
+from datetime import datetime, timedelta
+
+from werkzeug.http import http_date
+
+from app import db
+from app.archive import message_archive, month_start
+from app.models import Message
+from app.models.message import make_conversation_key
+
+
+def test_search_reports_where_archived_history_begins(make_app, add_user, client_for, tmp_path):
+    app = make_app(MESSAGE_ARCHIVE_DIR=str(tmp_path / 'archive'))
+    alice, bob = add_user(app, 'alice'), add_user(app, 'bob')
+    client = client_for(app, alice)
+    old_id = client.post('/api/messages', json={'recipient_id': bob, 'content': 'quarterly report draft'}).json['id']
+    new_id = client.post('/api/messages', json={'recipient_id': bob, 'content': 'final quarterly report'}).json['id']
+
+    response = client.get('/api/search', query_string={'q': 'report'}).json
+    assert {hit['id'] for hit in response['results']} == {old_id, new_id}
+    assert response['searchable_since'] is None
+
+    now = datetime.utcnow()
+    with app.app_context():
+        db.session.get(Message, old_id).timestamp = month_start(now, -5) + timedelta(days=1)
+        db.session.commit()
+        message_archive.rotate(now)
+
+    response = client.get('/api/search', query_string={'q': 'report'}).json
+    assert [hit['id'] for hit in response['results']] == [new_id]
+    assert response['searchable_since'] == http_date(month_start(now, -4))
+
+
+def test_read_only_search_uses_the_replica_without_creating_tables(make_app, add_user, client_for, tmp_path):
+    replica_path = tmp_path / 'replica.db'
+    app = make_app(SQLALCHEMY_BINDS={'replica': f'sqlite:///{replica_path}'}, REPLICA_STICKY_SECONDS=0)
+    alice, bob = add_user(app, 'alice'), add_user(app, 'bob')
+    with app.app_context():
+        # Stored without going through the index, so neither database has the FTS table yet
+        db.session.add(Message(sender_id=alice, recipient_id=bob, conversation_key=make_conversation_key(alice, bob),
+                               content='replicated report'))
+        db.session.commit()
+        db.session.remove()
+        db.engines['replica'].dispose()
+        shutil.copyfile(tmp_path / 'app.db', replica_path)
+
+    client = client_for(app, alice)
+    # Indexing this send creates the table on the primary only
+    assert client.post('/api/messages', json={'recipient_id': bob, 'content': 'primary report'}).status_code == 200
+    response = client.get('/api/search', query_string={'q': 'report'})
+    assert response.status_code == 200
+    assert [hit['content'] for hit in response.json['results']] == ['replicated report']
+
+    with sqlite3.connect(replica_path) as conn:
+        assert conn.execute("SELECT name FROM sqlite_master WHERE name = 'message_fts'").fetchall() == []
+
+
+def test_cold_archive_lives_under_the_instance_folder(make_app, add_user, client_for, tmp_path, monkeypatch):
+    instance = tmp_path / 'instance'
+    monkeypatch.setattr('flask.Flask.auto_find_instance_path', lambda self: str(instance))
+    app = make_app(MESSAGE_ARCHIVE_DIR='archive', MESSAGE_HOT_MONTHS=1, MESSAGE_WARM_MONTHS=1)
+    alice, bob = add_user(app, 'alice'), add_user(app, 'bob')
+    client = client_for(app, alice)
+    old_id = client.post('/api/messages', json={'recipient_id': bob, 'content': 'old news'}).json['id']
+
+    now = datetime.utcnow()
+    with app.app_context():
+        db.session.get(Message, old_id).timestamp = month_start(now, -3)
+        db.session.commit()
+        message_archive.rotate(now)
+        path, = [period.path for period in message_archive.periods()]
+    assert path == str(instance / 'archive' / f'messages-{month_start(now, -3):%Y-%m}.ndjson.gz')
+
+    # The catalog path does not depend on the working directory of whoever reads it later
+    monkeypatch.chdir(tmp_path)
+    assert [m['content'] for m in client.get(f'/api/messages/{bob}').json['messages']] == ['old news']
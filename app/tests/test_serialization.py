@@ -0,0 +1,42 @@
+from datetime import datetime
+
+import orjson
+import pytest
+from flask import jsonify
+from flask.json.provider import DefaultJSONProvider
+
+from app import serialization
+
+
+@pytest.fixture
+def orjson_calls(monkeypatch):
+    calls = []
+    original = orjson.dumps
+
+    def dumps(*args, **kwargs):
+        calls.append(args)
+        return original(*args, **kwargs)
+    monkeypatch.setattr(serialization.orjson, 'dumps', dumps)
+    return calls
+
+
+@pytest.mark.parametrize('debug', [False, True])
+def test_jsonify_uses_orjson(make_app, orjson_calls, debug):
+    app = make_app(DEBUG=debug)
+    assert isinstance(app.json, serialization.OrjsonProvider)
+    payload = {'b': 1, 'a': datetime(2024, 5, 1, 12, 30), 'nested': [{'z': None, 'y': 'é'}]}
+    with app.test_request_context():
+        body = jsonify(payload).get_data(as_text=True)
+        expected = DefaultJSONProvider(app).response(payload).get_data(as_text=True)
+    assert [args[0] for args in orjson_calls if args[0] is payload] == [payload]
+    assert orjson.loads(body) == orjson.loads(expected)
+    assert list(orjson.loads(body)) == ['a', 'b', 'nested']
+    assert ('\n  ' in body) is debug
+
+
+def test_api_responses_use_orjson(app, add_user, client_for, orjson_calls):
+    user_id = add_user(app, 'alice')
+    response = client_for(app, user_id).get('/api/profile')
+    assert response.status_code == 200
+    assert response.json['profile']['username'] == 'alice'
+    assert any('profile' in args[0] for args in orjson_calls if isinstance(args[0], dict))
@@ -0,0 +1,46 @@
+import pytest
+
+from app import socketio
+
+ROUND_TRIPS = 20
+
+
+@pytest.fixture
+def participants(app, add_user, client_for):
+    alice, bob = add_user(app, 'alice'), add_user(app, 'bob')
+    sock = socketio.test_client(app, flask_test_client=client_for(app, alice))
+    assert sock.is_connected()
+    return alice, bob, client_for(app, alice), sock
+
+
+def test_duplicate_send_acks_the_stored_message(app, add_user, participants):
+    alice, bob, http, sock = participants
+    carol = add_user(app, 'carol')
+    first = sock.emit('send_message', {'recipient_id': bob, 'content': 'original', 'client_msg_id': 'c-1'}, callback=True)
+    assert first['ok'] and not first['duplicate']
+
+    retry = sock.emit('send_message', {'recipient_id': carol, 'content': 'edited', 'client_msg_id': 'c-1'}, callback=True)
+    assert retry['duplicate']
+    assert retry['message'] == first['message']
+
+    response = http.post('/api/messages', json={'recipient_id': carol, 'content': 'edited', 'client_msg_id': 'c-1'})
+    assert response.json == first['message']
+
+
+def test_socket_and_http_sends_are_acked_and_delivered(participants):
+    alice, bob, http, sock = participants
+    sock.get_received()
+
+    acked = []
+    for n in range(ROUND_TRIPS):
+        response = http.post('/api/messages', json={'recipient_id': bob, 'content': f'http {n}'})
+        assert response.status_code == 200
+        acked.append(response.json)
+        ack = sock.emit('send_message', {'recipient_id': bob, 'content': f'socket {n}'}, callback=True)
+        assert ack['ok'] and not ack['duplicate']
+        acked.append(ack['message'])
+
+    # Latency of the two paths is compared by benchmarks/run.py, not here
+    delivered = [packet['args'] for packet in sock.get_received() if packet['name'] == 'message']
+    assert [message['id'] for message in delivered] == [message['id'] for message in acked]
+    assert [message['content'] for message in delivered] == [message['content'] for message in acked]
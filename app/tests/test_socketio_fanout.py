@@ -0,0 +1,59 @@
+import uuid
+
+import pytest
+from socketio import packet
+
+from app import socketio
+from app.presence import user_room
+
+SIMULATED_CONNECTIONS = 10000
+
+
+@pytest.fixture
+def sockets(app, add_user, client_for):
+    # One real Socket.IO test client per participant plus SIMULATED_CONNECTIONS bystanders
+    # registered straight in the room manager; every 'message' packet the server sends is counted
+    alice, bob = add_user(app, 'alice'), add_user(app, 'bob')
+    clients = {user_id: socketio.test_client(app, flask_test_client=client_for(app, user_id)) for user_id in (alice, bob)}
+    manager = socketio.server.manager
+    for n in range(SIMULATED_CONNECTIONS):
+        sid = manager.connect(uuid.uuid4().hex, '/')
+        manager.enter_room(sid, '/', user_room(1000 + n))
+
+    delivered = []
+    send_eio_packet = socketio.server._send_eio_packet
+
+    def counting_send_eio_packet(eio_sid, eio_pkt):
+        pkt = packet.Packet(encoded_packet=eio_pkt.data)
+        if pkt.packet_type == packet.EVENT and pkt.data[0] == 'message':
+            delivered.append(eio_sid)
+        send_eio_packet(eio_sid, eio_pkt)
+    socketio.server._send_eio_packet = counting_send_eio_packet
+    for client in clients.values():
+        client.get_received()
+    return alice, bob, clients, delivered
+
+
+def test_http_send_reaches_only_participants(app, client_for, sockets):
+    alice, bob, clients, delivered = sockets
+    sent = 20
+    for n in range(sent):
+        response = client_for(app, alice).post('/api/messages', json={'recipient_id': bob, 'content': f'hi {n}'})
+        assert response.status_code == 200
+    assert len(delivered) / sent == 2
+    assert len(clients[bob].get_received()) == sent
+
+
+def test_socket_send_reaches_only_participants(sockets):
+    alice, bob, clients, delivered = sockets
+    ack = clients[alice].emit('send_message', {'recipient_id': bob, 'content': 'hi'}, callback=True)
+    assert ack['ok']
+    assert len(delivered) == 2
+
+
+def test_legacy_message_event_echoes_to_sender_only(sockets):
+    alice, bob, clients, delivered = sockets
+    clients[alice].send({'sender_id': bob, 'content': 'spoofed'})
+    assert len(delivered) == 1
+    assert clients[alice].get_received()
+    assert clients[bob].get_received() == []
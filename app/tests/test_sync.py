@@ -0,0 +1,47 @@
+from datetime import datetime, timedelta
+
+from app import db
+from app.models import Message
+
+
+def _insert(app, message_id, sender_id, recipient_id, age_seconds):
+    with app.app_context():
+        db.session.add(Message(id=message_id, sender_id=sender_id, recipient_id=recipient_id, content=f'm{message_id}',
+                               timestamp=datetime.utcnow() - timedelta(seconds=age_seconds)))
+        db.session.commit()
+
+
+def _sync(client, since):
+    body = client.get(f'/api/sync?since={since}').json
+    return [message['id'] for message in body['messages']], body['cursor'], body['has_more']
+
+
+def test_cursor_waits_for_unsettled_messages(make_app, add_user, client_for):
+    app = make_app(SYNC_SETTLE_SECONDS=10)
+    alice, bob = add_user(app, 'alice'), add_user(app, 'bob')
+    client = client_for(app, bob)
+    _insert(app, 1, alice, bob, 60)
+    _insert(app, 2, alice, bob, 60)
+    # id 4 commits while id 3 is still in flight
+    _insert(app, 4, alice, bob, 1)
+
+    ids, cursor, has_more = _sync(client, 0)
+    assert ids == [1, 2, 4]
+    assert cursor == 2
+    assert not has_more
+
+    _insert(app, 3, alice, bob, 2)
+    ids, cursor, _ = _sync(client, cursor)
+    assert ids == [3, 4]
+    assert cursor == 2
+
+
+def test_cursor_advances_over_settled_messages(make_app, add_user, client_for):
+    app = make_app(SYNC_SETTLE_SECONDS=10, SYNC_BATCH_SIZE=2)
+    alice, bob = add_user(app, 'alice'), add_user(app, 'bob')
+    client = client_for(app, bob)
+    for message_id in (1, 2, 3):
+        _insert(app, message_id, alice, bob, 60)
+
+    assert _sync(client, 0) == ([1, 2], 2, True)
+    assert _sync(client, 2) == ([3], 3, False)
@@ -0,0 +1,62 @@
+from contextlib import contextmanager
+
+from sqlalchemy import event
+
+from app import db
+from app.cache import user_cache
+
+
+@contextmanager
+def count_queries(app):
+    with app.app_context():
+        engine = db.engine
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', count)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, 'before_cursor_execute', count)
+
+
+def test_authenticated_requests_skip_the_user_lookup(app, add_user, client_for):
+    alice = add_user(app, 'alice')
+    client = client_for(app, alice)
+
+    with count_queries(app) as cold:
+        assert client.get('/api/profile').json['profile']['username'] == 'alice'
+    with count_queries(app) as warm:
+        for _ in range(5):
+            assert client.get('/api/profile').status_code == 200
+    # Only the first request loads the user; later ones are served from the cache
+    assert len(cold) == 1
+    assert warm == []
+    assert user_cache.stats()['hits'] >= 5
+
+
+def test_contact_names_do_not_cost_a_query_each(app, add_user, client_for):
+    alice = add_user(app, 'alice')
+    client = client_for(app, alice)
+    counts = []
+    for batch in range(2):
+        for n in range(10 * batch, 10 * batch + 10):
+            assert client.post('/api/contacts', json={'contact_id': add_user(app, f'friend{n}')}).status_code == 201
+        client.get('/api/contacts')
+        with count_queries(app) as statements:
+            assert len(client.get('/api/contacts').json['contacts']) == 10 * batch + 10
+        counts.append(len(statements))
+    assert counts == [1, 1]
+
+
+def test_profile_update_invalidates_the_cached_user(app, add_user, client_for):
+    alice = add_user(app, 'alice')
+    client = client_for(app, alice)
+    client.get('/api/profile')
+    assert client.put('/api/profile', json={'username': 'alicia', 'email': 'alicia@example.com'}).json == {'success': True}
+
+    with count_queries(app) as statements:
+        assert client.get('/api/profile').json['profile'] == {'username': 'alicia', 'email': 'alicia@example.com'}
+    assert len(statements) == 1
@@ -0,0 +1,121 @@
+import atexit
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from . import db
+
+_STOP = object()
+
+
+class WriterBusy(Exception):
+    pass
+
+
+class MessageWriter:
+    # Group commit for message sends: requests enqueue rows and a single writer thread
+    # inserts them in multi-row batches, one commit per batch instead of per message.
+
+    def __init__(self):
+        self.app = None
+        self.enabled = False
+        self._queue = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def init_app(self, app):
+        # Re-initialising (another app in the same process) drains and stops the old thread,
+        # which would otherwise stay blocked on the previous queue
+        self.shutdown()
+        self._thread = None
+        self._closed = False
+        self.app = app
+        self.enabled = app.config.get('MESSAGE_WRITE_BATCHING', False)
+        self.batch_size = app.config.get('MESSAGE_BATCH_SIZE', 100)
+        self.interval = app.config.get('MESSAGE_BATCH_INTERVAL', 0.005)
+        self.put_timeout = app.config.get('MESSAGE_QUEUE_TIMEOUT', 0.5)
+        self.result_timeout = app.config.get('MESSAGE_WRITE_TIMEOUT', 5.0)
+        if self.enabled:
+            self._queue = queue.Queue(maxsize=app.config.get('MESSAGE_QUEUE_SIZE', 10000))
+            atexit.register(self.shutdown)
+
+    def submit(self, row):
+        # Returns a Future resolving to (stored message fields, duplicate) once the batch is committed
+        if self._closed:
+            raise WriterBusy('Message writer is shut down')
+        self._ensure_thread()
+        future = Future()
+        try:
+            self._queue.put((row, future), timeout=self.put_timeout)
+        except queue.Full:
+            raise WriterBusy('Message queue is full')
+        return future
+
+    def write(self, row):
+        return self.submit(row).result(timeout=self.result_timeout)
+
+    def shutdown(self):
+        # Flush whatever is queued, then stop the writer thread
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        if self._thread is not None:
+            self._queue.put(_STOP)
+            self._thread.join()
+
+    def _ensure_thread(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='message-writer', daemon=True)
+                    self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            stopping = item is _STOP
+            batch = [] if stopping else [item]
+            deadline = time.monotonic() + self.interval
+            while not stopping and len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                else:
+                    batch.append(item)
+            if stopping:
+                # Anything that raced in behind the stop marker is still flushed
+                while True:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is not _STOP:
+                        batch.append(item)
+            if batch:
+                self._write(batch)
+            if stopping:
+                return
+
+    def _write(self, batch):
+        from .messaging import store_messages
+
+        with self.app.app_context():
+            try:
+                results = store_messages([row for row, _ in batch])
+            except Exception as e:
+                db.session.rollback()
+                self.app.logger.exception('Message batch of %d failed', len(batch))
+                for _, future in batch:
+                    future.set_exception(e)
+                return
+        for (_, future), result in zip(batch, results):
+            future.set_result(result)
+
+
+message_writer = MessageWriter()
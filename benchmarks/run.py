@@ -0,0 +1,528 @@
+"""Benchmark and regression suite for the chat backend's hot paths.
+
+Seeds throwaway SQLite databases at several scales (users x messages), drives the
+Flask and Flask-SocketIO test clients in-process and reports throughput, p50/p99
+latency and SQL statements per request for each scenario.
+
+Suites:
+    scales    every hot path at each USERSxMESSAGES scale; fails if sending over Socket.IO
+              is slower (beyond --threshold) than the same send over HTTP
+    history   conversation pages from threads of 1k up to 1M messages; fails unless
+              page latency stays flat (within --threshold) from the shortest thread to the longest
+    writes    POST /api/messages from --senders concurrent clients, committed per request
+              and through the batched writer (MESSAGE_WRITE_BATCHING)
+    logins    GET /api/messages latency while --logins logins are in flight, with the password
+              KDF inline, with PASSWORD_HASH_POOL 'auto' and on the thread and process pools;
+              with --gevent the whole run is monkey-patched, as under a gevent server, and
+              'auto' moves the KDF to the hub's threadpool
+
+    python benchmarks/run.py                      # compare with benchmarks/baseline.json
+    python benchmarks/run.py --update-baseline    # record a new baseline
+    python benchmarks/run.py --scales 100x1000 --iterations 100 --threshold 0.5
+    python benchmarks/run.py --suites history --history-sizes 1000,100000
+    python benchmarks/run.py --suites logins --gevent
+
+Exits with status 1 when a scenario is slower, or issues more queries, than the
+baseline allows. Baselines are machine-specific; record them where the suite runs.
+"""
+import sys
+
+if '--gevent' in sys.argv:
+    # Patched before anything else imports threading or socket, as a gevent server would be
+    from gevent import monkey
+    monkey.patch_all()
+
+import argparse  # noqa: E402
+import json  # noqa: E402
+import os  # noqa: E402
+import random  # noqa: E402
+import tempfile  # noqa: E402
+import threading  # noqa: E402
+import time  # noqa: E402
+from concurrent.futures import ThreadPoolExecutor  # noqa: E402
+from datetime import datetime, timedelta  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from sqlalchemy import event, insert  # noqa: E402
+from sqlalchemy.engine import Engine  # noqa: E402
+from werkzeug.security import generate_password_hash  # noqa: E402
+
+from app import create_app, db, socketio  # noqa: E402
+from app.cache import user_cache  # noqa: E402
+from app.commands import rebuild_conversations  # noqa: E402
+from app.hashing import password_hasher  # noqa: E402
+from app.models import Contact, Message, User  # noqa: E402
+from app.models.message import make_conversation_key  # noqa: E402
+from app.pagination import encode_cursor  # noqa: E402
+from app.search import search_index  # noqa: E402
+from app.serialization import message_fragments  # noqa: E402
+from app.writer import message_writer  # noqa: E402
+
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+DEFAULT_SCALES = '100x1000,1000x10000,5000x100000'
+DEFAULT_HISTORY_SIZES = '1000,10000,100000,1000000'
+SUITES = ('scales', 'history', 'writes', 'logins')
+PASSWORD = 'benchmark-password'
+CONTACTS_PER_USER = 20
+WARMUP = 5
+# Reads arrive every READ_INTERVAL seconds while the logins suite's logins are in flight
+READ_INTERVAL = 0.01
+
+
+class QueryCounter:
+    # Statements are counted per thread, so a request is charged only for what its own thread ran
+    # and not for logins, writer flushes or anything else executing alongside it
+    def __init__(self):
+        self._counts = {}
+        event.listen(Engine, 'before_cursor_execute', self._on_execute)
+
+    def _on_execute(self, *args):
+        thread = threading.current_thread().name
+        self._counts[thread] = self._counts.get(thread, 0) + 1
+
+    def count(self, thread=None):
+        return self._counts.get(thread or threading.current_thread().name, 0)
+
+
+def seed(app, users, messages, rng):
+    pwhash = generate_password_hash(PASSWORD, app.config['PASSWORD_HASH_METHOD'])
+    with app.app_context():
+        db.create_all()
+        db.session.execute(insert(User), [
+            {'username': f'user{i}', 'email': f'user{i}@example.com', 'password_hash': pwhash} for i in range(users)
+        ])
+        ids = [user_id for user_id, in db.session.query(User.id).order_by(User.id)]
+        contacts = set()
+        for user_id in ids:
+            for peer_id in rng.sample(ids, min(CONTACTS_PER_USER + 1, len(ids))):
+                if peer_id != user_id:
+                    contacts.add((user_id, peer_id))
+        db.session.execute(insert(Contact), [{'user_id': a, 'contact_id': b} for a, b in contacts])
+
+        # Half of the traffic goes to user 1's threads so the measured conversations are long
+        start = datetime(2024, 1, 1)
+        pairs = sorted(contacts)
+        hot = [pair for pair in pairs if pair[0] == ids[0]]
+        batch = []
+        for n in range(messages):
+            sender_id, recipient_id = rng.choice(hot) if n % 2 else rng.choice(pairs)
+            if n % 3 == 0:
+                sender_id, recipient_id = recipient_id, sender_id
+            batch.append({
+                'sender_id': sender_id,
+                'recipient_id': recipient_id,
+                'conversation_key': make_conversation_key(sender_id, recipient_id),
+                'content': f'benchmark message {n}',
+                'timestamp': start + timedelta(seconds=n),
+            })
+            if len(batch) == 50000:
+                db.session.execute(insert(Message), batch)
+                batch = []
+        if batch:
+            db.session.execute(insert(Message), batch)
+        rebuild_conversations()
+        search_index.rebuild()
+        db.session.commit()
+        return ids, [peer_id for _, peer_id in hot]
+
+
+def logged_in_client(app, user_id):
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
+    return client
+
+
+def counted(operation, counter):
+    def run(i):
+        before = counter.count()
+        operation(i)
+        return counter.count() - before
+    return run
+
+
+def measure(name, iterations, operation, counter):
+    for i in range(min(WARMUP, iterations)):
+        operation(iterations + i)
+    run = counted(operation, counter)
+    latencies = []
+    queries = []
+    started = time.perf_counter()
+    for i in range(iterations):
+        t = time.perf_counter()
+        queries.append(run(i))
+        latencies.append(time.perf_counter() - t)
+    return summarize(latencies, time.perf_counter() - started, queries)
+
+
+def measure_concurrent(name, iterations, workers, operation, counter, background=None):
+    # operation(i) runs from `workers` threads at once; statements the `background` thread runs
+    # meanwhile (the batched writer's commits, say) are reported per request alongside
+    for i in range(min(WARMUP, iterations)):
+        operation(iterations + i)
+    run = counted(operation, counter)
+    latencies = []
+    queries = []
+    lock = threading.Lock()
+
+    def timed(i):
+        t = time.perf_counter()
+        n = run(i)
+        elapsed = time.perf_counter() - t
+        with lock:
+            latencies.append(elapsed)
+            queries.append(n)
+
+    before = counter.count(background) if background else 0
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(timed, range(iterations)))
+    result = summarize(latencies, time.perf_counter() - started, queries)
+    if background:
+        result['background_queries_per_request'] = round((counter.count(background) - before) / iterations, 2)
+    return result
+
+
+def measure_arrivals(iterations, interval, workers, operation, counter):
+    # Open loop: request i is due at start + i * interval and its latency runs from then, so
+    # waiting for a busy worker (or a blocked gevent hub) counts as it would for a real client
+    run = counted(operation, counter)
+    latencies = []
+    queries = []
+    lock = threading.Lock()
+    started = time.perf_counter()
+
+    def timed(i):
+        due = started + i * interval
+        delay = due - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        n = run(i)
+        with lock:
+            latencies.append(time.perf_counter() - due)
+            queries.append(n)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(timed, range(iterations)))
+    return summarize(latencies, time.perf_counter() - started, queries)
+
+
+def summarize(latencies, elapsed, queries):
+    # queries_per_request is the median request's statement count: the first requests' cache
+    # misses would otherwise be averaged in, and the gate would move with --iterations
+    latencies = sorted(latencies)
+    return {
+        'ops_per_sec': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(latencies[len(latencies) // 2] * 1000, 3),
+        'p99_ms': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000, 3),
+        'queries_per_request': sorted(queries)[len(queries) // 2],
+    }
+
+
+def check(status_code, expected=200):
+    if status_code != expected:
+        raise RuntimeError(f'unexpected status {status_code}')
+
+
+def make_app(path, **config):
+    settings = {
+        'SQLALCHEMY_DATABASE_URI': f'sqlite:///{path}',
+        'SQLALCHEMY_ENGINE_OPTIONS': {},
+        'SQLALCHEMY_BINDS': {},
+        'DEBUG': False,
+        'PROFILE_SLOW_REQUEST_SECONDS': None,
+        'LOG_LEVEL': 'WARNING',
+    }
+    settings.update(config)
+    app = create_app(settings)
+    user_cache.clear()
+    message_fragments.clear()
+    return app
+
+
+def run_scale(users, messages, iterations, workdir, rng, counter):
+    app = make_app(os.path.join(workdir, f'bench-{users}x{messages}.db'))
+    ids, peers = seed(app, users, messages, rng)
+    me = ids[0]
+    client = logged_in_client(app, me)
+    with app.app_context():
+        likeable = [message_id for message_id, in db.session.query(Message.id).filter(
+            (Message.sender_id == me) | (Message.recipient_id == me)).limit(iterations + WARMUP)]
+
+    results = {}
+    login_client = app.test_client()
+    results['login'] = measure('login', max(1, iterations // 10), lambda i: check(login_client.post(
+        '/login', json={'username': f'user{ids[i % len(ids)] - ids[0]}', 'password': PASSWORD}).status_code), counter)
+    results['get_contacts'] = measure('get_contacts', iterations, lambda i: check(
+        client.get('/api/contacts').status_code), counter)
+    results['get_messages'] = measure('get_messages', iterations, lambda i: check(
+        client.get(f'/api/messages/{peers[i % len(peers)]}?limit=50&n={i}').status_code), counter)
+    results['send_message'] = measure('send_message', iterations, lambda i: check(client.post(
+        '/api/messages', json={'recipient_id': peers[i % len(peers)], 'content': f'bench {i}'}).status_code), counter)
+    results['like_message'] = measure('like_message', min(iterations, len(likeable)), lambda i: check(
+        client.post(f'/api/messages/{likeable[i % len(likeable)]}/like').status_code), counter)
+
+    # The same send as send_message, acked over the sender's socket instead of an HTTP response
+    sock = socketio.test_client(app, flask_test_client=logged_in_client(app, me))
+    results['socket_send'] = measure('socket_send', iterations, lambda i: check(200 if sock.emit('send_message', {
+        'recipient_id': peers[i % len(peers)], 'content': f'socket {i}'}, callback=True)['ok'] else 500), counter)
+    sock.disconnect()
+
+    # Socket.IO fan-out: many sockets connected, each send must reach only its two participants
+    socket_users = ids[:min(len(ids), 50)]
+    sockets = {user_id: socketio.test_client(app, flask_test_client=logged_in_client(app, user_id)) for user_id in socket_users}
+    for sock in sockets.values():
+        sock.get_received()
+    targets = [user_id for user_id in socket_users if user_id != me] or [me]
+    sender = sockets[me]
+    fanout = measure('socketio_fanout', iterations, lambda i: sender.emit('send_message', {
+        'recipient_id': targets[i % len(targets)], 'content': f'socket {i}'}, callback=True), counter)
+    delivered = sum(len([packet for packet in sock.get_received() if packet['name'] == 'message']) for sock in sockets.values())
+    fanout['emits_per_message'] = round(delivered / (iterations + min(WARMUP, iterations)), 2)
+    results['socketio_fanout'] = fanout
+    for sock in sockets.values():
+        sock.disconnect()
+    return results
+
+
+def seed_thread(app, size):
+    # Two users and one conversation of `size` messages, one second apart
+    start = datetime(2024, 1, 1)
+    with app.app_context():
+        db.create_all()
+        pwhash = generate_password_hash(PASSWORD, app.config['PASSWORD_HASH_METHOD'])
+        db.session.execute(insert(User), [
+            {'username': f'user{i}', 'email': f'user{i}@example.com', 'password_hash': pwhash} for i in range(2)
+        ])
+        me, peer = (user_id for user_id, in db.session.query(User.id).order_by(User.id))
+        key = make_conversation_key(me, peer)
+        for offset in range(0, size, 50000):
+            db.session.execute(insert(Message), [{
+                'sender_id': me if n % 2 else peer,
+                'recipient_id': peer if n % 2 else me,
+                'conversation_key': key,
+                'content': f'benchmark message {n}',
+                'timestamp': start + timedelta(seconds=n),
+            } for n in range(offset, min(offset + 50000, size))])
+        rebuild_conversations()
+        db.session.commit()
+    return me, peer, start
+
+
+def run_history(size, iterations, workdir, rng, counter):
+    # No fragment cache: every page reads its rows, otherwise short threads would be served from memory
+    app = make_app(os.path.join(workdir, f'history-{size}.db'), MESSAGE_FRAGMENT_CACHE_SIZE=0)
+    me, peer, start = seed_thread(app, size)
+    client = logged_in_client(app, me)
+
+    # Message n has id n + 1 and timestamp start + n seconds, so any position can be a cursor
+    def deep_page(i):
+        n = rng.randrange(size)
+        cursor = encode_cursor(start + timedelta(seconds=n), n + 1)
+        check(client.get(f'/api/messages/{peer}?limit=50&before={cursor}').status_code)
+
+    return {
+        'latest_page': measure('latest_page', iterations, lambda i: check(
+            client.get(f'/api/messages/{peer}?limit=50&n={i}').status_code), counter),
+        'deep_page': measure('deep_page', iterations, deep_page, counter),
+    }
+
+
+def run_writes(messages, senders, workdir, rng, counter):
+    # The same burst of sends with one commit per request, then group-committed by the writer thread
+    results = {}
+    for name, batching in (('per_request', False), ('batched', True)):
+        app = make_app(os.path.join(workdir, f'writes-{name}.db'), MESSAGE_WRITE_BATCHING=batching)
+        ids, peers = seed(app, 100, 1000, rng)
+        clients = threading.local()
+        retries = []
+
+        def send(i):
+            if not hasattr(clients, 'client'):
+                clients.client = logged_in_client(app, ids[0])
+            # A full writer queue answers 503 + Retry-After; clients resend, and the wait counts
+            while True:
+                status = clients.client.post('/api/messages', json={
+                    'recipient_id': peers[i % len(peers)], 'content': f'burst {i}'}).status_code
+                if status != 503:
+                    return check(status)
+                retries.append(i)
+                time.sleep(0.1)
+
+        results[name] = measure_concurrent(name, messages, senders, send, counter,
+                                           background='message-writer' if batching else None)
+        results[name]['send_retries'] = len(retries)
+        message_writer.shutdown()
+    return results
+
+
+def run_logins(logins, iterations, workdir, rng, counter, green=False):
+    results = {}
+    modes = [('hash_inline', {'PASSWORD_HASH_WORKERS': 0}),
+             ('hash_auto', {'PASSWORD_HASH_POOL': 'auto'}),
+             ('hash_thread_pool', {'PASSWORD_HASH_POOL': 'thread'})]
+    if not green:
+        # Forking a worker pool from a monkey-patched process is not supported
+        modes.append(('hash_process_pool', {'PASSWORD_HASH_POOL': 'process'}))
+    for name, config in modes:
+        app = make_app(os.path.join(workdir, f'logins-{name}.db'), **config)
+        ids, peers = seed(app, logins, 1000, rng)
+        retries = []
+
+        # Each request starts by yielding, as reading it off a socket would; under gevent that
+        # is where a request waits for whatever is holding the hub
+        def log_in(n):
+            # Clients honour the 503 + Retry-After the hasher's back-pressure answers with
+            client = app.test_client()
+            while True:
+                time.sleep(0)
+                status = client.post('/login', json={'username': f'user{n}', 'password': PASSWORD}).status_code
+                if status != 503:
+                    return check(status)
+                retries.append(n)
+                time.sleep(0.1)
+
+        readers = threading.local()
+
+        def read(i):
+            time.sleep(0)
+            if not hasattr(readers, 'client'):
+                readers.client = logged_in_client(app, ids[0])
+            check(readers.client.get(f'/api/messages/{peers[i % len(peers)]}?limit=50&n={i}').status_code)
+
+        for i in range(WARMUP):
+            read(iterations + i)
+        # Every login is submitted before the reads start, so all of them are in flight together
+        with ThreadPoolExecutor(max_workers=logins) as storm:
+            started = time.perf_counter()
+            pending = [storm.submit(log_in, n) for n in range(logins)]
+            result = measure_arrivals(iterations, READ_INTERVAL, 16, read, counter)
+            for future in pending:
+                future.result()
+        result['logins_sec'] = round(time.perf_counter() - started, 2)
+        result['login_retries'] = len(retries)
+        results[name] = result
+        password_hasher.shutdown()
+    return results
+
+
+def check_flat(results, sizes, threshold):
+    # Keyset pages are one index range scan, so the longest thread must page like the shortest
+    failures = []
+    smallest, largest = f'history-{min(sizes)}', f'history-{max(sizes)}'
+    if smallest == largest:
+        return failures
+    for name, first in results[smallest].items():
+        last = results[largest][name]
+        if last['p50_ms'] > first['p50_ms'] * (1 + threshold):
+            failures.append(f'{largest} {name}: p50 {last["p50_ms"]}ms vs {first["p50_ms"]}ms at {smallest}')
+    return failures
+
+
+def check_socket_send(results, scales, threshold):
+    # Both paths go through _deliver_message; the socket one skips HTTP parsing and cookie
+    # handling, so it must never be meaningfully slower than the HTTP send
+    failures = []
+    for scale in scales:
+        http, sock = results[scale]['send_message'], results[scale]['socket_send']
+        if sock['p50_ms'] > http['p50_ms'] * (1 + threshold):
+            failures.append(f'{scale} socket_send: p50 {sock["p50_ms"]}ms vs send_message {http["p50_ms"]}ms')
+    return failures
+
+
+def compare(results, baseline, threshold):
+    failures = []
+    for scale, scenarios in results.items():
+        for name, current in scenarios.items():
+            previous = baseline.get(scale, {}).get(name)
+            if previous is None:
+                continue
+            if current['p50_ms'] > previous['p50_ms'] * (1 + threshold):
+                failures.append(f'{scale} {name}: p50 {current["p50_ms"]}ms vs baseline {previous["p50_ms"]}ms')
+            if current['ops_per_sec'] < previous['ops_per_sec'] * (1 - threshold):
+                failures.append(f'{scale} {name}: {current["ops_per_sec"]} ops/s vs baseline {previous["ops_per_sec"]}')
+            if current['queries_per_request'] > previous['queries_per_request']:
+                failures.append(f'{scale} {name}: {current["queries_per_request"]} queries/request vs baseline {previous["queries_per_request"]}')
+    return failures
+
+
+def print_table(results):
+    print(f'{"scale":<16}{"scenario":<18}{"ops/s":>10}{"p50 ms":>10}{"p99 ms":>10}{"queries":>9}')
+    for scale, scenarios in results.items():
+        for name, r in scenarios.items():
+            print(f'{scale:<16}{name:<18}{r["ops_per_sec"]:>10}{r["p50_ms"]:>10}{r["p99_ms"]:>10}{r["queries_per_request"]:>9}')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--suites', default=','.join(SUITES), help=f'Comma-separated suites to run ({", ".join(SUITES)}).')
+    parser.add_argument('--scales', default=DEFAULT_SCALES, help='Comma-separated USERSxMESSAGES scales.')
+    parser.add_argument('--history-sizes', default=DEFAULT_HISTORY_SIZES, help='Comma-separated thread lengths for the history suite.')
+    parser.add_argument('--iterations', type=int, default=300, help='Requests per scenario (login uses a tenth).')
+    parser.add_argument('--senders', type=int, default=16, help='Concurrent clients in the writes suite.')
+    parser.add_argument('--logins', type=int, default=100, help='Concurrent logins in the logins suite.')
+    parser.add_argument('--gevent', action='store_true', help='Monkey-patch with gevent; logins results go under logins-gevent.')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--threshold', type=float, default=0.5,
+                        help='Allowed relative slowdown before failing; query counts must not grow at all.')
+    parser.add_argument('--update-baseline', action='store_true')
+    parser.add_argument('--output', help='Also write this run\'s results to a JSON file.')
+    parser.add_argument('--seed', type=int, default=1234)
+    args = parser.parse_args(argv)
+
+    suites = args.suites.split(',')
+    unknown = set(suites) - set(SUITES)
+    if unknown:
+        parser.error(f'unknown suites: {", ".join(sorted(unknown))}')
+
+    rng = random.Random(args.seed)
+    counter = QueryCounter()
+    results = {}
+    failures = []
+    with tempfile.TemporaryDirectory() as workdir:
+        if 'scales' in suites:
+            for scale in args.scales.split(','):
+                users, messages = (int(part) for part in scale.lower().split('x'))
+                results[scale] = run_scale(users, messages, args.iterations, workdir, rng, counter)
+            failures += check_socket_send(results, args.scales.split(','), args.threshold)
+        if 'history' in suites:
+            sizes = [int(size) for size in args.history_sizes.split(',')]
+            for size in sizes:
+                results[f'history-{size}'] = run_history(size, args.iterations, workdir, rng, counter)
+            failures += check_flat(results, sizes, args.threshold)
+        if 'writes' in suites:
+            # Each sender gets --iterations messages so the queue actually fills up
+            results['writes'] = run_writes(args.iterations * args.senders, args.senders, workdir, rng, counter)
+        if 'logins' in suites:
+            key = 'logins-gevent' if args.gevent else 'logins'
+            results[key] = run_logins(args.logins, args.iterations, workdir, rng, counter, green=args.gevent)
+    print_table(results)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.update_baseline:
+        # Suites that were not run keep their recorded numbers
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(args.baseline, 'w') as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print(f'Baseline written to {args.baseline}')
+    elif not os.path.exists(args.baseline):
+        print(f'No baseline at {args.baseline}; run with --update-baseline first')
+    else:
+        with open(args.baseline) as f:
+            failures += compare(results, json.load(f), args.threshold)
+    for failure in failures:
+        print(f'REGRESSION {failure}')
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
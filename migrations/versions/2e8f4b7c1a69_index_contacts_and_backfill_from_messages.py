@@ -0,0 +1,45 @@
+"""Index contacts and backfill them from message history
+
+Revision ID: 2e8f4b7c1a69
+Revises: 9d3c6a1f5e82
+Create Date: 2026-10-18 11:26:48.904417
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2e8f4b7c1a69'
+down_revision = '9d3c6a1f5e82'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Drop duplicate pairs so the unique constraint can be created
+    op.execute(
+        "DELETE FROM contact WHERE id NOT IN "
+        "(SELECT MIN(id) FROM contact GROUP BY user_id, contact_id)"
+    )
+
+    with op.batch_alter_table('contact', schema=None) as batch_op:
+        batch_op.create_unique_constraint('uq_contact_user_contact', ['user_id', 'contact_id'])
+        batch_op.create_index('ix_contact_contact_id', ['contact_id'], unique=False)
+
+    # Contacts used to be "every user"; seed them with everyone a user has talked to
+    op.execute(
+        "INSERT INTO contact (user_id, contact_id) "
+        "SELECT pairs.user_id, pairs.contact_id FROM ("
+        "SELECT sender_id AS user_id, recipient_id AS contact_id FROM message "
+        "UNION SELECT recipient_id, sender_id FROM message"
+        ") AS pairs "
+        "WHERE pairs.user_id <> pairs.contact_id AND NOT EXISTS ("
+        "SELECT 1 FROM contact WHERE contact.user_id = pairs.user_id AND contact.contact_id = pairs.contact_id)"
+    )
+
+
+def downgrade():
+    with op.batch_alter_table('contact', schema=None) as batch_op:
+        batch_op.drop_index('ix_contact_contact_id')
+        batch_op.drop_constraint('uq_contact_user_contact', type_='unique')
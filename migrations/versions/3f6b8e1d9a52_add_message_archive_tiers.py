@@ -0,0 +1,75 @@
+"""Add message archive catalog and partitioned archive table
+
+Revision ID: 3f6b8e1d9a52
+Revises: 5c9e2d8a7b41
+Create Date: 2026-10-18 19:02:11.514306
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f6b8e1d9a52'
+down_revision = '5c9e2d8a7b41'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('message_period',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('period', sa.String(length=7), nullable=False),
+    sa.Column('tier', sa.String(length=8), nullable=False),
+    sa.Column('table_name', sa.String(length=64), nullable=True),
+    sa.Column('path', sa.String(length=255), nullable=True),
+    sa.Column('starts_at', sa.DateTime(), nullable=False),
+    sa.Column('ends_at', sa.DateTime(), nullable=False),
+    sa.Column('row_count', sa.Integer(), nullable=False),
+    sa.Column('first_id', sa.Integer(), nullable=True),
+    sa.Column('last_id', sa.Integer(), nullable=True),
+    sa.Column('archived_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('period')
+    )
+    op.create_table('message_period_conversation',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('period_id', sa.Integer(), nullable=False),
+    sa.Column('conversation_key', sa.String(length=41), nullable=False),
+    sa.Column('row_count', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['period_id'], ['message_period.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('conversation_key', 'period_id', name='uq_message_period_conversation_key_period')
+    )
+
+    if op.get_context().dialect.name == 'postgresql':
+        # Monthly partitions are attached by `flask archive-messages`; on SQLite each month is a plain table
+        op.create_table('message_archive',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('content', sa.String(length=500), nullable=False),
+        sa.Column('sender_id', sa.Integer(), nullable=True),
+        sa.Column('recipient_id', sa.Integer(), nullable=True),
+        sa.Column('conversation_key', sa.String(length=41), nullable=False),
+        sa.Column('client_msg_id', sa.String(length=64), nullable=True),
+        sa.Column('timestamp', sa.DateTime(), nullable=False),
+        sa.Column('likes', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('id', 'timestamp'),
+        postgresql_partition_by='RANGE (timestamp)'
+        )
+        op.create_index('ix_message_archive_conversation_timestamp_id', 'message_archive',
+                        ['conversation_key', 'timestamp', 'id'], unique=False)
+
+
+def downgrade():
+    dialect = op.get_context().dialect.name
+    if dialect == 'postgresql':
+        # Dropping the parent drops every attached partition
+        op.drop_index('ix_message_archive_conversation_timestamp_id', table_name='message_archive')
+        op.drop_table('message_archive')
+    elif dialect == 'sqlite':
+        tables = op.get_bind().execute(sa.text('SELECT table_name FROM message_period WHERE table_name IS NOT NULL')).scalars().all()
+        for table_name in tables:
+            op.drop_table(table_name)
+
+    op.drop_table('message_period_conversation')
+    op.drop_table('message_period')
@@ -0,0 +1,39 @@
+"""Add message conversation key and conversation index
+
+Revision ID: 4b1e7d2a9c30
+Revises: 87a531f92ddd
+Create Date: 2026-10-18 09:12:40.118204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4b1e7d2a9c30'
+down_revision = '87a531f92ddd'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('message', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('conversation_key', sa.String(length=41), nullable=True))
+
+    # Backfill the ordered "low:high" user pair for existing rows
+    op.execute(
+        "UPDATE message SET conversation_key = CASE "
+        "WHEN sender_id < recipient_id "
+        "THEN CAST(sender_id AS VARCHAR(20)) || ':' || CAST(recipient_id AS VARCHAR(20)) "
+        "ELSE CAST(recipient_id AS VARCHAR(20)) || ':' || CAST(sender_id AS VARCHAR(20)) END"
+    )
+
+    with op.batch_alter_table('message', schema=None) as batch_op:
+        batch_op.alter_column('conversation_key', existing_type=sa.String(length=41), nullable=False)
+        batch_op.create_index('ix_message_conversation_timestamp_id', ['conversation_key', 'timestamp', 'id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('message', schema=None) as batch_op:
+        batch_op.drop_index('ix_message_conversation_timestamp_id')
+        batch_op.drop_column('conversation_key')
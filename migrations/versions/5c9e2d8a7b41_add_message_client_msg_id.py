@@ -0,0 +1,28 @@
+"""Add client message id for idempotent sends
+
+Revision ID: 5c9e2d8a7b41
+Revises: e1f84c5b2d07
+Create Date: 2026-10-18 16:21:34.690125
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5c9e2d8a7b41'
+down_revision = 'e1f84c5b2d07'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('message', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('client_msg_id', sa.String(length=64), nullable=True))
+        batch_op.create_unique_constraint('uq_message_sender_client_msg_id', ['sender_id', 'client_msg_id'])
+
+
+def downgrade():
+    with op.batch_alter_table('message', schema=None) as batch_op:
+        batch_op.drop_constraint('uq_message_sender_client_msg_id', type_='unique')
+        batch_op.drop_column('client_msg_id')
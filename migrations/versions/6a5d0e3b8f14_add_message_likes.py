@@ -0,0 +1,38 @@
+"""Add message likes
+
+Revision ID: 6a5d0e3b8f14
+Revises: 2e8f4b7c1a69
+Create Date: 2026-10-18 12:40:05.731682
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6a5d0e3b8f14'
+down_revision = '2e8f4b7c1a69'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('message_like',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('message_id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('timestamp', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['message_id'], ['message.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('message_id', 'user_id', name='uq_message_like_message_user')
+    )
+    with op.batch_alter_table('message', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('likes', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade():
+    with op.batch_alter_table('message', schema=None) as batch_op:
+        batch_op.drop_column('likes')
+
+    op.drop_table('message_like')
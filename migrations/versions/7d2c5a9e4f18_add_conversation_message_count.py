@@ -0,0 +1,34 @@
+"""Add conversation message count
+
+Revision ID: 7d2c5a9e4f18
+Revises: 3f6b8e1d9a52
+Create Date: 2026-10-18 21:14:52.208734
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7d2c5a9e4f18'
+down_revision = '3f6b8e1d9a52'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('conversation', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('message_count', sa.Integer(), server_default='0', nullable=False))
+
+    # Start every thread at its current size; only changes to the count matter afterwards
+    op.execute(
+        'UPDATE conversation SET message_count = ('
+        'SELECT COUNT(*) FROM message WHERE '
+        '(message.sender_id = conversation.user_id AND message.recipient_id = conversation.peer_id) OR '
+        '(message.sender_id = conversation.peer_id AND message.recipient_id = conversation.user_id))'
+    )
+
+
+def downgrade():
+    with op.batch_alter_table('conversation', schema=None) as batch_op:
+        batch_op.drop_column('message_count')
@@ -0,0 +1,45 @@
+"""Add conversation summary table
+
+Revision ID: 9d3c6a1f5e82
+Revises: 4b1e7d2a9c30
+Create Date: 2026-10-18 10:03:17.552961
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9d3c6a1f5e82'
+down_revision = '4b1e7d2a9c30'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('conversation',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('peer_id', sa.Integer(), nullable=False),
+    sa.Column('last_message_id', sa.Integer(), nullable=True),
+    sa.Column('last_sender_id', sa.Integer(), nullable=True),
+    sa.Column('last_message_snippet', sa.String(length=100), nullable=True),
+    sa.Column('last_message_at', sa.DateTime(), nullable=True),
+    sa.Column('unread_count', sa.Integer(), nullable=False),
+    sa.Column('last_read_message_id', sa.Integer(), nullable=False),
+    sa.ForeignKeyConstraint(['peer_id'], ['user.id'], ),
+    sa.ForeignKeyConstraint(['user_id'], ['user.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('user_id', 'peer_id', name='uq_conversation_user_peer')
+    )
+    with op.batch_alter_table('conversation', schema=None) as batch_op:
+        batch_op.create_index('ix_conversation_user_last_message_at', ['user_id', 'last_message_at', 'id'], unique=False)
+
+    # Populate with `flask backfill-conversations` after upgrading
+
+
+def downgrade():
+    with op.batch_alter_table('conversation', schema=None) as batch_op:
+        batch_op.drop_index('ix_conversation_user_last_message_at')
+
+    op.drop_table('conversation')
@@ -0,0 +1,35 @@
+"""Add message full-text search index
+
+Revision ID: c7a2f9e4d13b
+Revises: 6a5d0e3b8f14
+Create Date: 2026-10-18 13:55:29.406813
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c7a2f9e4d13b'
+down_revision = '6a5d0e3b8f14'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    dialect = op.get_context().dialect.name
+    if dialect == 'postgresql':
+        # Text search config must match SEARCH_TS_CONFIG so the planner can use the index
+        op.create_index('ix_message_content_tsv', 'message',
+                        [sa.text("to_tsvector('english', content)")], postgresql_using='gin')
+    elif dialect == 'sqlite':
+        op.execute("CREATE VIRTUAL TABLE message_fts USING fts5(content, content='message', content_rowid='id')")
+        op.execute("INSERT INTO message_fts (message_fts) VALUES ('rebuild')")
+
+
+def downgrade():
+    dialect = op.get_context().dialect.name
+    if dialect == 'postgresql':
+        op.drop_index('ix_message_content_tsv', table_name='message')
+    elif dialect == 'sqlite':
+        op.execute('DROP TABLE message_fts')
@@ -0,0 +1,28 @@
+"""Add per-user message id indexes for delta sync
+
+Revision ID: e1f84c5b2d07
+Revises: c7a2f9e4d13b
+Create Date: 2026-10-18 15:08:51.276940
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e1f84c5b2d07'
+down_revision = 'c7a2f9e4d13b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('message', schema=None) as batch_op:
+        batch_op.create_index('ix_message_sender_id_id', ['sender_id', 'id'], unique=False)
+        batch_op.create_index('ix_message_recipient_id_id', ['recipient_id', 'id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('message', schema=None) as batch_op:
+        batch_op.drop_index('ix_message_recipient_id_id')
+        batch_op.drop_index('ix_message_sender_id_id')